@@ -0,0 +1,272 @@
+"""
+Batched Embeddings
+
+LangChain-compatible embedder shared by the RAG and GraphRAG chains. Uses an
+Infinity embedding server when INFINITY_URL is set, otherwise a local
+sentence-transformers model (on GPU in FP16 when CUDA is available, or an
+int8-quantized ONNX export on CPU when EMBED_BACKEND=onnx).
+"""
+import asyncio
+import atexit
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+LOCAL_EMBEDDING_MODEL = os.getenv(
+    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")  # torch | onnx
+# Quantized export shipped in the model repo (see optimum-cli to export your own)
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))  # 0 lets onnxruntime use every physical core
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))  # 0 keeps torch's default (physical cores)
+INFINITY_URL = os.getenv("INFINITY_URL", "")
+INFINITY_BATCH_SIZE = int(os.getenv("INFINITY_BATCH_SIZE", "32"))
+INFINITY_CONCURRENCY = int(os.getenv("INFINITY_CONCURRENCY", "8"))
+EMBED_QUERY_CACHE_SIZE = int(os.getenv("EMBED_QUERY_CACHE_SIZE", "1024"))  # 0 disables
+EMBED_QUERY_BATCH_WINDOW_MS = int(os.getenv("EMBED_QUERY_BATCH_WINDOW_MS", "0"))  # >0 coalesces concurrent queries
+
+_embedder = None
+
+
+def _configure_torch_threads(torch):
+    """Size torch's CPU thread pools before the first forward pass."""
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    try:
+        # encode() runs one op at a time, so inter-op threads would only sit idle
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed once any parallel work has run in this process
+
+
+class _QueryBatcher:
+    """Coalesces embed_query calls from concurrent request threads into one forward pass."""
+
+    def __init__(self, embed_many, window_ms: int):
+        self._embed_many = embed_many
+        self._window = window_ms / 1000
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []  # (text, Future)
+
+    def embed(self, text: str) -> List[float]:
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            leader = len(self._pending) == 1
+        if leader:
+            # The first caller waits one window for others to join, then embeds for everyone
+            time.sleep(self._window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            try:
+                vectors = self._embed_many([text for text, _ in batch])
+            except Exception as e:
+                for _, waiter in batch:
+                    waiter.set_exception(e)
+            else:
+                for (_, waiter), vector in zip(batch, vectors):
+                    waiter.set_result(vector)
+        return future.result()
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeds texts in length-sorted micro-batches, remotely or with a local model."""
+
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, infinity_url: Optional[str] = None):
+        self.model_name = model_name
+        self.infinity_url = (infinity_url or "").rstrip("/")
+        self._model = None
+        self._pool = None
+        self._http: Optional[httpx.Client] = None
+        self._async_http: Dict[Any, httpx.AsyncClient] = {}  # event loop -> client
+        # Query vectors keyed by a digest of the whitespace-normalized text, oldest first
+        self._query_cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._query_batcher = (
+            _QueryBatcher(self.embed_documents, EMBED_QUERY_BATCH_WINDOW_MS)
+            if EMBED_QUERY_BATCH_WINDOW_MS > 0 else None
+        )
+        if self.infinity_url:
+            self._reset_http()
+            atexit.register(lambda: self._http.close())
+            print(f"Using Infinity embedding server: {self.infinity_url} ({model_name})")
+        else:
+            from sentence_transformers import SentenceTransformer
+            import torch
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            if device == "cpu":
+                _configure_torch_threads(torch)
+            if EMBED_BACKEND == "onnx" and device == "cpu":
+                import onnxruntime
+
+                session_options = onnxruntime.SessionOptions()
+                session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+                session_options.intra_op_num_threads = EMBED_ONNX_THREADS
+                print(f"Loading embedding model: {model_name} (onnx, {EMBED_ONNX_FILE})")
+                self._model = SentenceTransformer(
+                    model_name,
+                    device=device,
+                    backend="onnx",
+                    model_kwargs={
+                        "file_name": EMBED_ONNX_FILE,
+                        "provider": "CPUExecutionProvider",
+                        "session_options": session_options,
+                    },
+                )
+            else:
+                print(f"Loading embedding model: {model_name} ({device})")
+                self._model = SentenceTransformer(model_name, device=device)
+                if device == "cuda":
+                    self._model.half()
+
+    @staticmethod
+    def _http_limits() -> httpx.Limits:
+        return httpx.Limits(max_keepalive_connections=INFINITY_CONCURRENCY)
+
+    def _reset_http(self):
+        """Fresh worker threads and connection pools (at start, and in forked workers)."""
+        self._pool = ThreadPoolExecutor(max_workers=INFINITY_CONCURRENCY, thread_name_prefix="embed")
+        # Shared clients so every embedding call reuses pooled keep-alive connections
+        self._http = httpx.Client(timeout=60.0, limits=self._http_limits())
+        self._async_http.clear()
+
+    def _get_async_http(self) -> httpx.AsyncClient:
+        """Async clients are bound to the event loop that first uses them."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_http:
+            self._async_http[loop] = httpx.AsyncClient(timeout=60.0, limits=self._http_limits())
+        return self._async_http[loop]
+
+    async def aclose(self):
+        """Close the async client opened on the running event loop (app shutdown)."""
+        client = self._async_http.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def _micro_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text positions by length so each request pads as little as possible."""
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        return [order[i:i + INFINITY_BATCH_SIZE] for i in range(0, len(order), INFINITY_BATCH_SIZE)]
+
+    def _request_body(self, texts: List[str], batch: List[int]) -> dict:
+        return {"model": self.model_name, "input": [texts[i] for i in batch]}
+
+    @staticmethod
+    def _scatter(batches: List[List[int]], responses: List[httpx.Response], size: int) -> List[List[float]]:
+        """Put each batch's vectors back at their original text positions."""
+        vectors: List[List[float]] = [None] * size
+        for batch, response in zip(batches, responses):
+            response.raise_for_status()
+            for item in response.json()["data"]:
+                vectors[batch[item["index"]]] = item["embedding"]
+        return vectors
+
+    def _encode_local(self, texts: List[str]) -> List[List[float]]:
+        # SentenceTransformer.encode already length-sorts internally before batching
+        return self._model.encode(
+            texts, batch_size=EMBED_BATCH_SIZE, normalize_embeddings=True
+        ).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self._model is not None:
+            return self._encode_local(texts)
+
+        batches = self._micro_batches(texts)
+        url = f"{self.infinity_url}/embeddings"
+        responses = list(self._pool.map(
+            lambda batch: self._http.post(url, json=self._request_body(texts, batch)), batches
+        ))
+        return self._scatter(batches, responses, len(texts))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self._model is not None:
+            return await asyncio.to_thread(self._encode_local, texts)
+
+        batches = self._micro_batches(texts)
+        url = f"{self.infinity_url}/embeddings"
+        limit = asyncio.Semaphore(INFINITY_CONCURRENCY)
+
+        client = self._get_async_http()
+
+        async def post(batch: List[int]) -> httpx.Response:
+            async with limit:
+                return await client.post(url, json=self._request_body(texts, batch))
+
+        responses = await asyncio.gather(*(post(batch) for batch in batches))
+        return self._scatter(batches, responses, len(texts))
+
+    @staticmethod
+    def _query_key(text: str) -> bytes:
+        return hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+
+    def _cached_query(self, key: bytes) -> Optional[List[float]]:
+        with self._query_cache_lock:
+            vector = self._query_cache.get(key)
+            if vector is not None:
+                self._query_cache.move_to_end(key)
+            return vector
+
+    def _cache_query(self, key: bytes, vector: List[float]):
+        if EMBED_QUERY_CACHE_SIZE <= 0:
+            return
+        with self._query_cache_lock:
+            self._query_cache[key] = vector
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > EMBED_QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._query_key(text)
+        vector = self._cached_query(key)
+        if vector is None:
+            if self._query_batcher is not None:
+                vector = self._query_batcher.embed(text)
+            else:
+                vector = self.embed_documents([text])[0]
+            self._cache_query(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._query_key(text)
+        vector = self._cached_query(key)
+        if vector is None:
+            vector = (await self.aembed_documents([text]))[0]
+            self._cache_query(key, vector)
+        return vector
+
+
+def _reset_after_fork():
+    """Forked workers (gunicorn --preload) must not share the parent's connections or threads."""
+    if _embedder is not None and _embedder.infinity_url:
+        _embedder._reset_http()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def close_async_embedding_clients():
+    """Close the shared embedder's Infinity client for the running event loop, if one was opened."""
+    if _embedder is not None:
+        await _embedder.aclose()
+
+
+def get_embedding_model() -> BatchedEmbeddings:
+    """Get or create the shared embedding model."""
+    global _embedder
+    if _embedder is None:
+        _embedder = BatchedEmbeddings(LOCAL_EMBEDDING_MODEL, INFINITY_URL or None)
+    return _embedder
@@ -4,48 +4,168 @@ Graph Loader Module
 Fetches graph structure from the analytics API and provides traversal functions
 for GraphRAG.
 """
+import atexit
+import hashlib
 import os
-import json
-from typing import Dict, List, Set, Optional
+import re
+import tempfile
+import time
+from typing import Dict, List, Set, Optional, Tuple
 from collections import defaultdict
+from itertools import chain
 import httpx
+import numpy as np
+import orjson
 
 GRAPH_API_URL = os.getenv("GRAPH_API_URL", "http://localhost:5001/graph/nodes")
 GRAPH_CACHE_TTL = int(os.getenv("GRAPH_CACHE_TTL", "300"))  # 5 minutes
+# Last fetched payload, reused on cold starts within the TTL and when the API is down
+GRAPH_CACHE_PATH = os.getenv("GRAPH_CACHE_PATH", "graph_cache.json")
 
-_graph_data = None
 _graph_cache_time = None
 
 
+def _cache_path(graph_url: str) -> str:
+    """GRAPH_CACHE_PATH with a digest of the graph URL, so loaders for different APIs never share a cache."""
+    if not GRAPH_CACHE_PATH:
+        return ""
+    root, ext = os.path.splitext(GRAPH_CACHE_PATH)
+    return f"{root}.{hashlib.blake2b(graph_url.encode('utf-8'), digest_size=6).hexdigest()}{ext}"
+
+
+def _new_http_client() -> httpx.Client:
+    return httpx.Client(
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+    )
+
+
+def _reset_http_client():
+    """Open a fresh connection pool in forked workers (gunicorn --preload)."""
+    global _http_client
+    _http_client = _new_http_client()
+
+
+# Shared client so graph reloads reuse pooled keep-alive connections
+_http_client = _new_http_client()
+atexit.register(lambda: _http_client.close())
+os.register_at_fork(after_in_child=_reset_http_client)
+
+
 class GraphLoader:
     """Loads and provides access to the codebase graph structure."""
 
     def __init__(self, graph_url: str = GRAPH_API_URL):
         self.graph_url = graph_url
+        self.cache_path = _cache_path(graph_url)
         self.nodes: Dict[str, Dict] = {}
         self.edges: List[Dict] = []
-        self.node_edges: Dict[str, List[Dict]] = defaultdict(list)  # node_id -> edges
+        # node_id -> [(other_id, relation)], split by direction so each edge is stored once per side
+        self.out_edges: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        self.in_edges: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        self.degree: Dict[str, int] = {}
+        self.degrees = np.zeros(0, dtype=np.int32)  # idx -> degree, for ranking inside traverse
+        # CSR adjacency over integer node indexes (both directions), used by traverse
+        self.node_ids: List[str] = []  # idx -> node_id
+        self.id_to_idx: Dict[str, int] = {}
+        self.rel_vocab: Dict[Optional[str], int] = {}  # relation -> code
+        self.indptr = np.zeros(1, dtype=np.int32)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.relations = np.zeros(0, dtype=np.int16)
+        self.nodes_by_type: Dict[str, List[Dict]] = defaultdict(list)
+        self.nodes_by_basename: Dict[str, List[Dict]] = defaultdict(list)
+        self.nodes_by_dir_component: Dict[str, List[Dict]] = defaultdict(list)  # any dir component -> nodes
+        self._node_paths: Dict[str, str] = {}  # node_id -> normalized, lowercased source path
+        self._source_matches: Dict[str, List[Dict]] = {}  # source_path -> find_nodes_by_source result
+        # Pre-formatted GraphRAG context: node line and (other_id, "RELATION: label") pairs
+        self.node_context_line: Dict[str, str] = {}
+        self.node_relations: Dict[str, List[Tuple[str, str]]] = {}
+        self.vehicle_id_to_nodes: Dict[str, List[str]] = {}  # lowercased payload id -> node ids
+        self._vehicle_id_folds: Dict[str, List[str]] = {}  # matched id -> node ids of every id inside it
+        self._vehicle_id_pattern: Optional[re.Pattern] = None
         self._loaded = False
 
-    def load(self) -> bool:
-        """Fetch graph data from the analytics API."""
+    def _fetch_payload(self, use_cache: bool) -> bytes:
+        """Return the raw graph JSON, from the local cache file when it is fresh."""
+        cache_age = None
+        if self.cache_path and os.path.exists(self.cache_path):
+            cache_age = time.time() - os.path.getmtime(self.cache_path)
+        if use_cache and cache_age is not None and cache_age <= GRAPH_CACHE_TTL:
+            with open(self.cache_path, "rb") as f:
+                return f.read()
+
         try:
-            response = httpx.get(self.graph_url, timeout=10.0)
+            response = _http_client.get(self.graph_url)
             response.raise_for_status()
-            data = response.json()
-
-            self.nodes = {node["id"]: node for node in data.get("nodes", [])}
-            self.edges = data.get("edges", [])
+        except Exception as e:
+            if cache_age is None:
+                raise
+            print(f"⚠️ Graph API unavailable ({e}); using cached graph from {self.cache_path} ({cache_age:.0f}s old)")
+            with open(self.cache_path, "rb") as f:
+                return f.read()
+
+        payload = response.content
+        if self.cache_path:
+            try:
+                # A private temp file per write: several workers may refresh the cache at once
+                with tempfile.NamedTemporaryFile(
+                    dir=os.path.dirname(os.path.abspath(self.cache_path)),
+                    prefix=f"{os.path.basename(self.cache_path)}.",
+                    suffix=".tmp",
+                    delete=False,
+                ) as f:
+                    f.write(payload)
+                try:
+                    os.replace(f.name, self.cache_path)
+                except OSError:
+                    os.unlink(f.name)
+                    raise
+            except OSError as e:
+                print(f"⚠️ Could not write graph cache {self.cache_path}: {e}")
+        return payload
+
+    def load(self, use_cache: bool = True) -> bool:
+        """Fetch graph data from the analytics API (or the fresh local cache)."""
+        try:
+            # orjson parses straight from the raw bytes, skipping the str decode
+            data = orjson.loads(self._fetch_payload(use_cache))
+
+            self.nodes = {node["id"]: node for node in data.get("nodes") or ()}
+            self.edges = data.get("edges") or []
+            self._source_matches = {}
+
+            # Build node indexes so lookups don't rescan every node per query.
+            # Keys are lowercased to match the case-insensitive path matching.
+            self.nodes_by_type = defaultdict(list)
+            self.nodes_by_basename = defaultdict(list)
+            self.nodes_by_dir_component = defaultdict(list)
+            self._node_paths = {}
+            for node in self.nodes.values():
+                self.nodes_by_type[node.get("type")].append(node)
+                node_source = node.get("source", "")
+                if node_source:
+                    node_normalized = os.path.normpath(node_source).lower()
+                    self._node_paths[node["id"]] = node_normalized
+                    self.nodes_by_basename[os.path.basename(node_normalized)].append(node)
+                    for component in set(os.path.dirname(node_normalized).split(os.sep)):
+                        if component:
+                            self.nodes_by_dir_component[component].append(node)
+
+            self._index_vehicle_ids()
 
             # Build edge index for fast traversal
+            self.out_edges = defaultdict(list)
+            self.in_edges = defaultdict(list)
             for edge in self.edges:
                 from_id = edge.get("from")
                 to_id = edge.get("to")
-                if from_id:
-                    self.node_edges[from_id].append(edge)
-                if to_id:
+                if from_id and to_id:
+                    relation = edge.get("relation")
+                    self.out_edges[from_id].append((to_id, relation))
                     # Also index reverse for bidirectional traversal
-                    self.node_edges[to_id].append(edge)
+                    self.in_edges[to_id].append((from_id, relation))
+            self._build_csr()
+            self._build_context_strings()
 
             self._loaded = True
             print(f"✅ Graph loaded: {len(self.nodes)} nodes, {len(self.edges)} edges")
@@ -55,6 +175,98 @@ class GraphLoader:
             self._loaded = False
             return False
 
+    def _index_vehicle_ids(self) -> None:
+        """Compile one pattern matching every Vehicle payload id."""
+        ids: Dict[str, List[str]] = defaultdict(list)
+        for node in self.nodes_by_type.get("Vehicle", []):
+            payload_id = (node.get("payload") or {}).get("id")
+            if payload_id:
+                ids[str(payload_id).lower()].append(node["id"])
+
+        self.vehicle_id_to_nodes = dict(ids)
+        self._vehicle_id_folds = {}
+        if ids:
+            # Longest first inside a lookahead so overlapping ids are all found
+            alternation = "|".join(re.escape(i) for i in sorted(ids, key=len, reverse=True))
+            self._vehicle_id_pattern = re.compile(f"(?=({alternation}))")
+        else:
+            self._vehicle_id_pattern = None
+
+    def _build_csr(self) -> None:
+        """Pack the bidirectional adjacency into contiguous int arrays."""
+        self.node_ids = list(self.nodes)
+        self.id_to_idx = {node_id: idx for idx, node_id in enumerate(self.node_ids)}
+        self.rel_vocab = {}
+
+        src, dst, rels = [], [], []
+        for from_id, targets in self.out_edges.items():
+            for to_id, relation in targets:
+                # Edge endpoints missing from the node list still get an index
+                for node_id in (from_id, to_id):
+                    if node_id not in self.id_to_idx:
+                        self.id_to_idx[node_id] = len(self.node_ids)
+                        self.node_ids.append(node_id)
+                src.append(self.id_to_idx[from_id])
+                dst.append(self.id_to_idx[to_id])
+                rels.append(self.rel_vocab.setdefault(relation, len(self.rel_vocab)))
+
+        num_nodes = len(self.node_ids)
+        src = np.asarray(src, dtype=np.int32)
+        dst = np.asarray(dst, dtype=np.int32)
+        rels = np.asarray(rels, dtype=np.int16)
+        # Each edge appears once per endpoint; the stable sort keeps out-edges first
+        both_src = np.concatenate([src, dst])
+        order = np.argsort(both_src, kind="stable")
+        self.indices = np.concatenate([dst, src])[order]
+        self.relations = np.concatenate([rels, rels])[order]
+        self.indptr = np.zeros(num_nodes + 1, dtype=np.int32)
+        np.cumsum(np.bincount(both_src, minlength=num_nodes), out=self.indptr[1:])
+
+        self.degrees = np.diff(self.indptr)
+        self.degree = dict(zip(self.node_ids, self.degrees.tolist()))
+
+    def _build_context_strings(self) -> None:
+        """Format each node's context line and relation labels once per load."""
+        self.node_context_line = {}
+        self.node_relations = {}
+        for node_id, node in self.nodes.items():
+            source = node.get("source", "")
+            self.node_context_line[node_id] = (
+                f"- {node.get('type', 'Unknown')}: {node.get('label', node_id)} "
+                f"(from {os.path.basename(source) if source else 'unknown'})"
+            )
+            self.node_relations[node_id] = [
+                (other_id, f"{relation or 'RELATED_TO'}: {self.nodes[other_id].get('label', other_id)}")
+                for other_id, relation in self.iter_edges(node_id)
+                if other_id in self.nodes
+            ]
+
+    def find_vehicle_nodes_in_text(self, text: str) -> Set[str]:
+        """Return ids of Vehicle nodes whose payload id appears in lowercased text."""
+        if not self._loaded or self._vehicle_id_pattern is None:
+            return set()
+
+        node_ids = set()
+        for match in set(self._vehicle_id_pattern.findall(text)):
+            node_ids.update(self._fold_vehicle_id(match))
+        return node_ids
+
+    def _fold_vehicle_id(self, payload_id: str) -> List[str]:
+        """
+        Node ids for a matched id and every other id contained in it.
+
+        The pattern only reports the longest id at each position, so shorter ids
+        inside a match are looked up among its substrings (memoized per id).
+        """
+        folded = self._vehicle_id_folds.get(payload_id)
+        if folded is None:
+            n = len(payload_id)
+            substrings = {payload_id[i:j] for i in range(n) for j in range(i + 1, n + 1)}
+            folded = [node_id for sub in substrings & self.vehicle_id_to_nodes.keys()
+                      for node_id in self.vehicle_id_to_nodes[sub]]
+            self._vehicle_id_folds[payload_id] = folded
+        return folded
+
     def get_node(self, node_id: str) -> Optional[Dict]:
         """Get a node by ID."""
         return self.nodes.get(node_id)
@@ -63,25 +275,29 @@ class GraphLoader:
         self, node_id: str, relation_filter: Optional[str] = None
     ) -> List[Dict]:
         """Get all neighbors of a node, optionally filtered by relation type."""
-        if not self._loaded or node_id not in self.node_edges:
+        if not self._loaded:
             return []
 
         neighbors = []
-        for edge in self.node_edges[node_id]:
-            if relation_filter and edge.get("relation") != relation_filter:
+        for other_id, relation in self.iter_edges(node_id):
+            if relation_filter and relation != relation_filter:
                 continue
 
-            other_id = edge.get("to") if edge.get("from") == node_id else edge.get("from")
-            if other_id and other_id in self.nodes:
+            if other_id in self.nodes:
                 neighbors.append(self.nodes[other_id])
 
         return neighbors
 
+    def iter_edges(self, node_id: str):
+        """Iterate (other_id, relation) pairs for edges in either direction."""
+        return chain(self.out_edges.get(node_id, ()), self.in_edges.get(node_id, ()))
+
     def traverse(
         self,
         start_node_ids: List[str],
         depth: int = 2,
         relation_filters: Optional[List[str]] = None,
+        max_nodes: Optional[int] = None,
     ) -> Set[str]:
         """
         Traverse graph from starting nodes up to specified depth.
@@ -90,6 +306,9 @@ class GraphLoader:
             start_node_ids: List of node IDs to start from
             depth: Maximum traversal depth
             relation_filters: Optional list of relation types to follow
+            max_nodes: Stop expanding once this many nodes are reached; the
+                start nodes are always kept and the last level is trimmed to
+                its best-connected nodes
 
         Returns:
             Set of node IDs reached during traversal
@@ -97,62 +316,94 @@ class GraphLoader:
         if not self._loaded:
             return set()
 
-        visited = set()
-        current_level = set(start_node_ids)
+        # Level-synchronous BFS over the CSR arrays: each level gathers the
+        # neighbours of the whole frontier at once and marks them visited on
+        # enqueue, so no node is expanded twice and the last level is never expanded.
+        rel_mask = None
+        if relation_filters:
+            rel_mask = np.zeros(len(self.rel_vocab), dtype=bool)
+            rel_mask[[self.rel_vocab[r] for r in relation_filters if r in self.rel_vocab]] = True
+
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        frontier = np.unique(
+            np.asarray([self.id_to_idx[n] for n in start_node_ids if n in self.id_to_idx], dtype=np.int32)
+        )
+        visited[frontier] = True
+        reached_count = int(frontier.size)
 
         for _ in range(depth):
-            next_level = set()
-            for node_id in current_level:
-                if node_id in visited:
-                    continue
-                visited.add(node_id)
+            if max_nodes and reached_count >= max_nodes:
+                break
 
-                for edge in self.node_edges.get(node_id, []):
-                    if relation_filters and edge.get("relation") not in relation_filters:
-                        continue
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            total = int(counts.sum())
+            if not total:
+                break
 
-                    other_id = edge.get("to") if edge.get("from") == node_id else edge.get("from")
-                    if other_id and other_id not in visited:
-                        next_level.add(other_id)
+            # Positions of every edge slot belonging to the frontier nodes
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+            if rel_mask is not None:
+                offsets = offsets[rel_mask[self.relations[offsets]]]
+            neighbors = np.unique(self.indices[offsets])
 
-            current_level = next_level
-            if not current_level:
+            frontier = neighbors[~visited[neighbors]]
+            if not frontier.size:
                 break
+            if max_nodes and reached_count + frontier.size > max_nodes:
+                ranked = np.argsort(-self.degrees[frontier], kind="stable")
+                frontier = frontier[ranked[: max_nodes - reached_count]]
+            visited[frontier] = True
+            reached_count += int(frontier.size)
 
-        return visited
+        reached = set(start_node_ids)  # unknown start ids are still reported, as before
+        reached.update(self.node_ids[idx] for idx in np.flatnonzero(visited))
+        return reached
 
     def find_nodes_by_source(self, source_path: str) -> List[Dict]:
         """Find all nodes that reference a specific source file path."""
         if not self._loaded or not source_path:
             return []
 
+        cached = self._source_matches.get(source_path)
+        if cached is not None:
+            return cached
+
         # Normalize paths for matching (handle both relative and absolute paths)
         # Extract just the filename and relevant path components
-        import os
         source_normalized = os.path.normpath(source_path).lower()
         source_basename = os.path.basename(source_normalized)
-        
-        matches = []
-        for node in self.nodes.values():
-            node_source = node.get("source", "")
-            if not node_source:
-                continue
-            
-            # Normalize node source path
-            node_normalized = os.path.normpath(node_source).lower()
-            node_basename = os.path.basename(node_normalized)
-            
-            # Match if:
-            # 1. Source path is contained in node source (both normalized)
-            # 2. Node source ends with source path
-            # 3. Basenames match (same filename)
-            # 4. Path components match (e.g., both in mycarhub/src/)
-            if (source_normalized in node_normalized or 
-                node_normalized.endswith(source_normalized) or
-                source_basename == node_basename or
-                source_normalized.replace(source_basename, "") in node_normalized):
-                matches.append(node)
+        source_dir = os.path.dirname(source_normalized)
+
+        # Match if:
+        # 1. Basenames match (same filename)
+        # 2. The node's enclosing directory has the same name as the chunk's
+        # 3. The chunk's directory appears in the node path (e.g. both in
+        #    mycarhub/src/), so the node is in that directory or below it;
+        #    this also covers node paths containing the whole chunk path
+        # Apart from basename matches, every match has the chunk's last
+        # directory component among its own directories (or, for a one-level
+        # chunk directory like "hub/", a directory ending in it, e.g. "mycarhub/"),
+        # so the component index supplies the candidates for 2 and 3.
+        matches = {node["id"]: node for node in self.nodes_by_basename.get(source_basename, [])}
+        if source_dir:
+            dir_name = os.path.basename(source_dir)
+            dir_prefix = source_dir + os.sep
+            if os.sep in source_dir:
+                components = [dir_name]
+            else:
+                components = [c for c in self.nodes_by_dir_component if c.endswith(dir_name)]
+            candidates = (node for c in components for node in self.nodes_by_dir_component[c])
+            for node in candidates:
+                if node["id"] in matches:
+                    continue
+                node_normalized = self._node_paths[node["id"]]
+                if (os.path.basename(os.path.dirname(node_normalized)) == dir_name
+                        or dir_prefix in node_normalized):
+                    matches[node["id"]] = node
+        matches = list(matches.values())
 
+        self._source_matches[source_path] = matches
         return matches
 
     def get_nodes_by_type(self, node_type: str) -> List[Dict]:
@@ -160,7 +411,7 @@ class GraphLoader:
         if not self._loaded:
             return []
 
-        return [node for node in self.nodes.values() if node.get("type") == node_type]
+        return self.nodes_by_type.get(node_type, [])
 
     def is_loaded(self) -> bool:
         """Check if graph is loaded."""
@@ -172,17 +423,21 @@ _graph_loader = None
 
 
 def get_graph_loader() -> GraphLoader:
-    """Get or create the global graph loader instance."""
-    global _graph_loader
-    if _graph_loader is None:
-        _graph_loader = GraphLoader()
-        _graph_loader.load()
+    """Get the global graph loader instance, reloading it once GRAPH_CACHE_TTL expires."""
+    global _graph_loader, _graph_cache_time
+    now = time.monotonic()
+    if _graph_loader is None or now - _graph_cache_time > GRAPH_CACHE_TTL:
+        graph_loader = GraphLoader()
+        # Keep serving the previous graph if the analytics API is temporarily down
+        if graph_loader.load() or _graph_loader is None or not _graph_loader.is_loaded():
+            _graph_loader = graph_loader
+        _graph_cache_time = now
     return _graph_loader
 
 
 def reload_graph() -> bool:
-    """Force reload the graph from the API."""
-    global _graph_loader
+    """Force reload the graph from the API, bypassing the local cache file."""
+    global _graph_loader, _graph_cache_time
     _graph_loader = GraphLoader()
-    return _graph_loader.load()
-
+    _graph_cache_time = time.monotonic()
+    return _graph_loader.load(use_cache=False)
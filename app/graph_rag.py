@@ -3,25 +3,24 @@ GraphRAG Implementation
 
 Combines vector embeddings (RAG) with graph structure for enhanced code analysis.
 """
+import asyncio
+import heapq
 import os
+import re
+from functools import lru_cache
 from typing import Dict, List, Optional, Set
 
 from langchain.prompts import PromptTemplate
-from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
-from .graph_loader import get_graph_loader
+from .embeddings import get_embedding_model as _get_embedding_model
+from .vectorstore import create_vectorstore, vectorstore_location
+from .graph_loader import GraphLoader, get_graph_loader
 from .llm_factory import get_llm
 
-LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "chroma_db")
-LOCAL_COLLECTION_NAME = os.getenv("LOCAL_COLLECTION_NAME", "code_assistant_local")
-LOCAL_EMBEDDING_MODEL = os.getenv(
-    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
-)
-
 RAG_K = int(os.getenv("RAG_K", "10"))
 GRAPH_DEPTH = int(os.getenv("GRAPH_DEPTH", "2"))
 GRAPH_MAX_NODES = int(os.getenv("GRAPH_MAX_NODES", "20"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
 
 GRAPH_RAG_TEMPLATE = """
 You are an expert software developer AI assistant specialized in code analysis using GraphRAG.
@@ -51,65 +50,58 @@ ANSWER:
 
 GRAPH_RAG_PROMPT = PromptTemplate.from_template(GRAPH_RAG_TEMPLATE)
 
+# Chunk keywords that pull in FleetInventory nodes
+_INVENTORY_HINTS = re.compile(r"db\.json|database|inventory")
+
 vectorstore = None
 graph_rag_chain = None
-_embedder = None
 
 
-def _get_embedding_model():
-    """Get or create the embedding model."""
-    global _embedder
-    if _embedder is None:
-        print(f"Loading embedding model: {LOCAL_EMBEDDING_MODEL}")
-        _embedder = HuggingFaceEmbeddings(model_name=LOCAL_EMBEDDING_MODEL)
-    return _embedder
+def _reset_after_fork():
+    """Drop the parent's vector store and chain in forked workers; the lifespan rebuilds them."""
+    global vectorstore, graph_rag_chain
+    vectorstore = None
+    graph_rag_chain = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)
+def _retrieve(question: str) -> tuple:
+    """Embed the question once and fetch its top-k chunks (cached per question)."""
+    embedding = _get_embedding_model().embed_query(question)
+    return tuple(vectorstore.similarity_search_by_vector(embedding, k=RAG_K))
+
 
+def refresh_retrieval():
+    """Drop cached retrievals after the collection was re-indexed."""
+    _retrieve.cache_clear()
 
-def _extract_node_ids_from_chunks(chunks: List) -> Set[str]:
+
+def _extract_node_ids_from_chunks(chunks: List, graph_loader: GraphLoader) -> Set[str]:
     """Extract potential node IDs from retrieved code chunks."""
     node_ids = set()
-    graph_loader = get_graph_loader()
 
     for chunk in chunks:
         metadata = chunk.metadata or {}
         source_path = metadata.get("source", "")
 
         if source_path:
-            # Find nodes that reference this source file (exact match)
-            related_nodes = graph_loader.find_nodes_by_source(source_path)
-            for node in related_nodes:
+            # Find nodes that reference this source file or share its directory
+            for node in graph_loader.find_nodes_by_source(source_path):
                 node_ids.add(node["id"])
-            
-            # Also try to match by directory - if chunk is from mycarhub/src/,
-            # find nodes from same directory structure
-            import os
-            source_dir = os.path.dirname(source_path)
-            if source_dir:
-                # Check if any node sources are in the same directory structure
-                for node in graph_loader.nodes.values():
-                    node_source = node.get("source", "")
-                    if node_source:
-                        node_dir = os.path.dirname(os.path.normpath(node_source))
-                        # Match if directories overlap (e.g., both in mycarhub/src/)
-                        if source_dir in node_dir or node_dir.endswith(source_dir) or source_dir.endswith(os.path.basename(node_dir)):
-                            node_ids.add(node["id"])
 
         # Also try to extract vehicle IDs or other identifiers from content
         content = chunk.page_content.lower()
         # Look for common patterns (vehicle IDs, component names, etc.)
         # This is a simple heuristic - can be enhanced
         if "vehicle" in content or "car" in content:
-            # Try to find vehicle nodes
-            vehicle_nodes = graph_loader.get_nodes_by_type("Vehicle")
-            for vnode in vehicle_nodes:
-                payload = vnode.get("payload", {})
-                if payload.get("id"):
-                    # Check if this ID appears in the chunk
-                    if str(payload["id"]).lower() in content:
-                        node_ids.add(vnode["id"])
+            # Single scan for every known vehicle ID instead of one search per vehicle
+            node_ids.update(graph_loader.find_vehicle_nodes_in_text(content))
         
         # If chunk mentions "db.json" or "database", try to find FleetInventory nodes
-        if "db.json" in content or "database" in content or "inventory" in content:
+        if _INVENTORY_HINTS.search(content):
             fleet_nodes = graph_loader.get_nodes_by_type("FleetInventory")
             for fleet_node in fleet_nodes:
                 node_ids.add(fleet_node["id"])
@@ -117,49 +109,38 @@ def _extract_node_ids_from_chunks(chunks: List) -> Set[str]:
     return node_ids
 
 
-def _get_graph_context(node_ids: Set[str]) -> str:
+def _get_graph_context(node_ids: Set[str], graph_loader: GraphLoader) -> str:
     """Build graph context string from node IDs."""
     if not node_ids:
         return "No graph relationships found."
 
-    graph_loader = get_graph_loader()
     if not graph_loader.is_loaded():
         return "Graph not available."
 
-    # Traverse graph from these nodes
-    all_related = graph_loader.traverse(list(node_ids), depth=GRAPH_DEPTH)
+    # Traverse graph from these nodes; the BFS stops expanding at GRAPH_MAX_NODES
+    all_related = graph_loader.traverse(list(node_ids), depth=GRAPH_DEPTH, max_nodes=GRAPH_MAX_NODES)
 
-    # Limit to max nodes
+    # The retrieved nodes alone can exceed the budget; keep the best-connected ones
     if len(all_related) > GRAPH_MAX_NODES:
-        all_related = set(list(all_related)[:GRAPH_MAX_NODES])
+        all_related = set(
+            heapq.nlargest(
+                GRAPH_MAX_NODES,
+                all_related,
+                key=lambda nid: (nid in node_ids, graph_loader.degree.get(nid, 0)),
+            )
+        )
 
     context_parts = []
     for node_id in all_related:
-        node = graph_loader.get_node(node_id)
-        if not node:
+        line = graph_loader.node_context_line.get(node_id)
+        if not line:
             continue
 
-        node_type = node.get("type", "Unknown")
-        label = node.get("label", node_id)
-        source = node.get("source", "")
-
-        # Get neighbors with relations
-        neighbors = graph_loader.get_neighbors(node_id)
-        relations = []
-        # Access node_edges through the graph_loader instance
-        node_edges = getattr(graph_loader, 'node_edges', {})
-        for edge in node_edges.get(node_id, []):
-            other_id = edge.get("to") if edge.get("from") == node_id else edge.get("from")
-            if other_id in all_related:
-                other_node = graph_loader.get_node(other_id)
-                if other_node:
-                    rel_type = edge.get("relation", "RELATED_TO")
-                    other_label = other_node.get("label", other_id)
-                    relations.append(f"{rel_type}: {other_label}")
-
-        context_parts.append(
-            f"- {node_type}: {label} (from {os.path.basename(source) if source else 'unknown'})"
-        )
+        context_parts.append(line)
+        relations = [
+            relation for other_id, relation in graph_loader.node_relations[node_id]
+            if other_id in all_related
+        ]
         if relations:
             context_parts.append(f"  Relations: {', '.join(relations[:3])}")  # Limit relations
 
@@ -172,18 +153,15 @@ def initialize_graph_rag():
 
     try:
         # Load vector store
-        print(f"📦 Loading vector store from {LOCAL_VECTOR_STORE_PATH}...")
+        print(f"📦 Loading vector store from {vectorstore_location()}...")
         embedding_model = _get_embedding_model()
-        vectorstore = Chroma(
-            persist_directory=LOCAL_VECTOR_STORE_PATH,
-            collection_name=LOCAL_COLLECTION_NAME,
-            embedding_function=embedding_model,
-        )
+        vectorstore = create_vectorstore(embedding_model)
+        _retrieve.cache_clear()
         
         # Check if vector store has data
         try:
             collection_count = vectorstore._collection.count()
-            print(f"✅ Vector store loaded: {LOCAL_VECTOR_STORE_PATH} ({collection_count} documents)")
+            print(f"✅ Vector store loaded: {vectorstore_location()} ({collection_count} documents)")
             if collection_count == 0:
                 print("⚠️ WARNING: Vector store is empty! Index the codebase first.")
         except Exception as e:
@@ -233,18 +211,8 @@ def initialize_graph_rag():
         raise
 
 
-def get_graph_rag_answer(question: str) -> Dict:
-    """
-    Get answer using GraphRAG (vectors + graph).
-
-    Args:
-        question: User question
-
-    Returns:
-        Dict with answer, sources, and graph_context
-    """
-    global graph_rag_chain, vectorstore
-    
+def _ensure_initialized() -> Optional[Dict]:
+    """Initialize GraphRAG if needed; return an error result if that is not possible."""
     # Try to initialize if not already done
     if not graph_rag_chain or vectorstore is None:
         print("⚠️ GraphRAG not initialized. Attempting initialization...")
@@ -269,16 +237,20 @@ def get_graph_rag_answer(question: str) -> Dict:
             "graph_context": "No graph relationships found.",
             "nodes_found": 0,
         }
+    return None
+
+
+def ensure_initialized() -> bool:
+    """Initialize GraphRAG unless that is already done; returns whether it is ready."""
+    return _ensure_initialized() is None
 
-    # Step 1: Vector search
-    retriever = vectorstore.as_retriever(search_kwargs={"k": RAG_K})
-    # Use invoke() instead of deprecated get_relevant_documents()
-    vector_chunks = retriever.invoke(question)
 
-    # Step 2: Extract node IDs from chunks
-    node_ids = _extract_node_ids_from_chunks(vector_chunks)
+def _build_prompt(question: str, vector_chunks, graph_loader: GraphLoader) -> Dict:
+    """Combine retrieved chunks and graph relationships into the LLM prompt."""
+    # Extract node IDs from chunks
+    node_ids = _extract_node_ids_from_chunks(vector_chunks, graph_loader)
 
-    # Step 3: Format sources (do this early so it's available in error handling)
+    # Format sources (do this early so it's available in error handling)
     sources = []
     for chunk in vector_chunks:
         metadata = chunk.metadata or {}
@@ -286,14 +258,16 @@ def get_graph_rag_answer(question: str) -> Dict:
         sources.append(
             {
                 "source": os.path.basename(source_path),
+                "id": getattr(chunk, "id", None),
+                "chars": len(chunk.page_content),
                 "content": chunk.page_content[:200] + "...",
             }
         )
 
-    # Step 4: Get graph context
-    graph_context = _get_graph_context(node_ids) if node_ids else "No graph relationships found."
+    # Get graph context
+    graph_context = _get_graph_context(node_ids, graph_loader) if node_ids else "No graph relationships found."
 
-    # Step 5: Build combined context
+    # Build combined context
     code_context = "\n\n".join(
         [
             f"[{i+1}] {chunk.page_content[:500]}..."
@@ -301,54 +275,135 @@ def get_graph_rag_answer(question: str) -> Dict:
         ]
     )
 
-    # Step 6: Generate answer with LLM
     # We need to manually format the prompt with graph context since the chain doesn't know about it
-    try:
-        llm = get_llm()
-        full_prompt = GRAPH_RAG_PROMPT.format(
-            question=question,
-            code_context=code_context,
-            graph_context=graph_context,
-        )
-        response = llm.invoke(full_prompt)
-        # Extract text from response (handle both string and message objects)
-        if isinstance(response, str):
-            answer = response
-        elif hasattr(response, 'content'):
-            answer = response.content
-        elif hasattr(response, 'text'):
-            answer = response.text
-        else:
-            answer = str(response)
-    except Exception as e:
-        error_msg = str(e)
-        # Provide helpful error messages for common issues
-        if "BILLING_DISABLED" in error_msg or "billing" in error_msg.lower():
-            error_msg = f"❌ Billing not enabled on Google Cloud project.\n\n{error_msg}\n\nEnable billing: https://console.cloud.google.com/billing"
-        elif "403" in error_msg or "permission" in error_msg.lower():
-            error_msg = f"❌ Permission error accessing LLM API.\n\n{error_msg}\n\nCheck IAM roles and authentication."
-        elif "404" in error_msg or "not found" in error_msg.lower():
-            error_msg = f"❌ LLM endpoint/model not found.\n\n{error_msg}\n\nCheck model name and endpoint configuration.\n\nAvailable Qwen models on Vertex AI:\n- qwen-2.5-7b-instruct (may need full path)\n- qwen-7b-instruct\n- Try: @google-cloud/aiplatform Python SDK or check Model Garden"
-        
-        return {
-            "answer": f"Error generating answer:\n\n{error_msg}",
-            "sources": sources,  # Return sources even if LLM failed
-            "graph_context": graph_context,
-        }
+    prompt = GRAPH_RAG_PROMPT.format(
+        question=question,
+        code_context=code_context,
+        graph_context=graph_context,
+    )
+    return {"prompt": prompt, "sources": sources, "graph_context": graph_context, "node_ids": node_ids}
+
+
+def _response_text(response) -> str:
+    """Extract text from an LLM response (handle both string and message objects)."""
+    if isinstance(response, str):
+        answer = response
+    elif hasattr(response, 'content'):
+        answer = response.content
+    elif hasattr(response, 'text'):
+        answer = response.text
+    else:
+        answer = str(response)
+    return answer.strip() if isinstance(answer, str) else str(answer)
+
+
+def _llm_error_result(error: Exception, context: Dict) -> Dict:
+    """Build the result returned when the LLM call fails."""
+    error_msg = str(error)
+    # Provide helpful error messages for common issues
+    if "BILLING_DISABLED" in error_msg or "billing" in error_msg.lower():
+        error_msg = f"❌ Billing not enabled on Google Cloud project.\n\n{error_msg}\n\nEnable billing: https://console.cloud.google.com/billing"
+    elif "403" in error_msg or "permission" in error_msg.lower():
+        error_msg = f"❌ Permission error accessing LLM API.\n\n{error_msg}\n\nCheck IAM roles and authentication."
+    elif "404" in error_msg or "not found" in error_msg.lower():
+        error_msg = f"❌ LLM endpoint/model not found.\n\n{error_msg}\n\nCheck model name and endpoint configuration.\n\nAvailable Qwen models on Vertex AI:\n- qwen-2.5-7b-instruct (may need full path)\n- qwen-7b-instruct\n- Try: @google-cloud/aiplatform Python SDK or check Model Garden"
+    
+    return {
+        "answer": f"Error generating answer:\n\n{error_msg}",
+        "sources": context["sources"],  # Return sources even if LLM failed
+        "graph_context": context["graph_context"],
+    }
+
 
+def _answer_result(answer: str, context: Dict) -> Dict:
+    """Build the result returned for a generated answer."""
     return {
-        "answer": answer.strip() if isinstance(answer, str) else str(answer),
-        "sources": sources,
-        "graph_context": graph_context,
-        "nodes_found": len(node_ids),
+        "answer": answer,
+        "sources": context["sources"],
+        "graph_context": context["graph_context"],
+        "nodes_found": len(context["node_ids"]),
     }
 
 
-# Initialize on import - but catch errors so the app can still start
-try:
-    initialize_graph_rag()
-except Exception as e:
-    print(f"\n❌ GraphRAG initialization failed on import.")
-    print(f"   It will be retried when needed. Error: {e}\n")
-    graph_rag_chain = None
+def get_graph_rag_answer(question: str) -> Dict:
+    """
+    Get answer using GraphRAG (vectors + graph).
+
+    Args:
+        question: User question
+
+    Returns:
+        Dict with answer, sources, and graph_context
+    """
+    error_result = _ensure_initialized()
+    if error_result:
+        return error_result
+
+    # Step 1: Vector search (repeated questions skip the embedding + Chroma query)
+    vector_chunks = _retrieve(question)
+
+    # Step 2: Combine code chunks and graph context into the prompt
+    context = _build_prompt(question, vector_chunks, get_graph_loader())
+
+    # Step 3: Generate answer with LLM
+    try:
+        response = get_llm().invoke(context["prompt"])
+    except Exception as e:
+        return _llm_error_result(e, context)
+
+    return _answer_result(_response_text(response), context)
+
+
+async def get_graph_rag_answers(questions: List[str]) -> List[Dict]:
+    """
+    Answer several questions at once using GraphRAG.
+
+    All questions are embedded in a single batch, the Chroma searches run
+    concurrently in worker threads, and the LLM calls are issued concurrently.
+
+    Args:
+        questions: User questions
+
+    Returns:
+        One result dict per question, in the same order
+    """
+    if not questions:
+        return []
+
+    # Initialization, the graph's TTL reload and LLM creation all block, so none of them run on the event loop
+    error_result = await asyncio.to_thread(_ensure_initialized)
+    if error_result:
+        return [dict(error_result) for _ in questions]
+
+    # Step 1: One embedding batch, then concurrent vector searches
+    embeddings = await _get_embedding_model().aembed_documents(list(questions))
+    all_chunks = await asyncio.gather(
+        *(
+            asyncio.to_thread(vectorstore.similarity_search_by_vector, embedding, k=RAG_K)
+            for embedding in embeddings
+        )
+    )
+
+    # Step 2: Build every prompt against the same graph snapshot
+    graph_loader = await asyncio.to_thread(get_graph_loader)
+    contexts = [
+        _build_prompt(question, chunks, graph_loader)
+        for question, chunks in zip(questions, all_chunks)
+    ]
+
+    # Step 3: Concurrent LLM calls; a failure only affects its own question
+    try:
+        llm = await asyncio.to_thread(get_llm)
+    except Exception as e:
+        return [_llm_error_result(e, context) for context in contexts]
+    responses = await asyncio.gather(
+        *(llm.ainvoke(context["prompt"]) for context in contexts),
+        return_exceptions=True,
+    )
 
+    return [
+        _llm_error_result(response, context)
+        if isinstance(response, Exception)
+        else _answer_result(_response_text(response), context)
+        for response, context in zip(responses, contexts)
+    ]
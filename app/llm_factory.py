@@ -5,12 +5,14 @@ Provides unified interface for switching between different LLM providers
 (Local Ollama, Google Cloud Vertex AI, AWS SageMaker, OpenAI).
 """
 import os
-from typing import Optional
+from typing import Any, Dict, Optional
 
-from .rag_chain import SageMakerServerlessLLM, _get_llm as _get_sagemaker_llm
-from .vertex_llm import create_vertex_llm, VertexAIQwenLLM
+from .rag_chain import _get_llm as _get_sagemaker_llm
+from .vertex_llm import create_vertex_llm
 
-_llm_instance = None
+_llm_instances: Dict[str, Any] = {}  # provider -> LLM instance
+# Forked workers (gunicorn --preload) must not share the parent's LLM client connections
+os.register_at_fork(after_in_child=_llm_instances.clear)
 
 
 def _get_configured_provider() -> str:
@@ -78,53 +80,46 @@ def get_llm(provider: Optional[str] = None):
     Returns:
         LangChain LLM instance
     """
-    global _llm_instance
     provider = (provider or _get_configured_provider()).lower()
 
+    # Instances are cached per provider so switching back and forth reuses clients
+    if provider in _llm_instances:
+        return _llm_instances[provider]
+
     if provider == "vertex":
-        if _llm_instance is None or not isinstance(_llm_instance, VertexAIQwenLLM):
-            print("🔵 Initializing Google Cloud Vertex AI LLM (Qwen)...")
-            _llm_instance = create_vertex_llm()
-            print(f"✅ Vertex AI LLM ready: {_llm_instance.model_name}")
-        return _llm_instance
+        print("🔵 Initializing Google Cloud Vertex AI LLM (Qwen)...")
+        llm = create_vertex_llm()
+        print(f"✅ Vertex AI LLM ready: {llm.model_name}")
 
     elif provider == "sagemaker":
-        if _llm_instance is None or not isinstance(_llm_instance, SageMakerServerlessLLM):
-            print("🟠 Initializing AWS SageMaker LLM (Qwen)...")
-            _llm_instance = _get_sagemaker_llm()
-            print(f"✅ SageMaker LLM ready: {_llm_instance.endpoint_name}")
-        return _llm_instance
+        print("🟠 Initializing AWS SageMaker LLM (Qwen)...")
+        llm = _get_sagemaker_llm()
+        print(f"✅ SageMaker LLM ready: {llm.endpoint_name}")
 
     elif provider == "openai":
-        # Check if we need to reinitialize (different provider or not initialized)
-        from langchain_openai import ChatOpenAI
-        if _llm_instance is None or not isinstance(_llm_instance, ChatOpenAI):
-            print("⚪ Initializing OpenAI LLM...")
-            _llm_instance = _get_openai_llm()
-            model_name = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
-            print(f"✅ OpenAI LLM ready: {model_name}")
-        return _llm_instance
+        print("⚪ Initializing OpenAI LLM...")
+        llm = _get_openai_llm()
+        model_name = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
+        print(f"✅ OpenAI LLM ready: {model_name}")
 
     elif provider == "ollama":
-        from langchain_community.chat_models import ChatOllama
-
-        if _llm_instance is None or not isinstance(_llm_instance, ChatOllama):
-            print("💻 Initializing local Ollama LLM...")
-            _llm_instance = _get_ollama_llm()
-            model_name = os.getenv("OLLAMA_MODEL_NAME", "llama3.1:8b-instruct-q4_1")
-            print(f"✅ Ollama LLM ready: {model_name}")
-        return _llm_instance
+        print("💻 Initializing local Ollama LLM...")
+        llm = _get_ollama_llm()
+        model_name = os.getenv("OLLAMA_MODEL_NAME", "llama3.1:8b-instruct-q4_1")
+        print(f"✅ Ollama LLM ready: {model_name}")
 
     else:
         raise ValueError(
             f"Unknown LLM provider: {provider}. Use 'ollama', 'vertex', 'sagemaker', or 'openai'"
         )
 
+    _llm_instances[provider] = llm
+    return llm
+
 
 def reset_llm():
-    """Reset the cached LLM instance (useful when switching providers)."""
-    global _llm_instance
-    _llm_instance = None
+    """Reset the cached LLM instances (useful when provider settings change)."""
+    _llm_instances.clear()
 
 
 def get_current_provider() -> str:
@@ -1,8 +1,13 @@
+import asyncio
+import json
 import os
-import subprocess
-from typing import Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from itertools import islice
+from typing import List, Optional
 from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
@@ -11,20 +16,70 @@ from dotenv import load_dotenv
 # Load environment variables from .env file FIRST
 load_dotenv()
 
-from .rag_chain import get_answer, list_all_document_sources
-from .graph_rag import get_graph_rag_answer
-from .llm_factory import get_current_provider, reset_llm
+from .rag_chain import (
+    aget_answer,
+    close_async_sagemaker_clients,
+    get_answer,
+    get_answer_stream,
+    get_answers,
+    get_document,
+    list_all_document_sources,
+    refresh_retrieval as refresh_rag_retrieval,
+    warm_up_rag_components,
+)
+from .embeddings import close_async_embedding_clients
+from .graph_rag import get_graph_rag_answer, get_graph_rag_answers, refresh_retrieval as refresh_graph_rag_retrieval
+from .llm_factory import get_current_provider
 
 LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "chroma_db")
 LOCAL_COLLECTION_NAME = os.getenv("LOCAL_COLLECTION_NAME", "code_assistant_local")
 INDEX_SCRIPT_PATH = "scripts/index_codebase.py"
+RAG_WORKERS = int(os.getenv("RAG_WORKERS", "4"))
+INDEX_LOG_MAX = int(os.getenv("INDEX_LOG_MAX", "2000"))
+INDEX_LOG_LINE_MAX = 16384  # characters kept per indexer output line
+INDEX_STREAM_LIMIT = 1024 * 1024  # longest raw line the subprocess reader accepts
+INDEX_TIMEOUT = int(os.getenv("INDEX_TIMEOUT", "3600"))  # seconds before a stuck indexer is killed
+INDEX_STREAM_KEEPALIVE = 15  # seconds between SSE comments while the indexer is quiet
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "false").lower() == "true"
+
+# Blocking RAG/LLM calls run here so /ask never stalls the event loop
+RAG_EXECUTOR = ThreadPoolExecutor(max_workers=RAG_WORKERS, thread_name_prefix="rag")
+
+if PRELOAD_MODELS:
+    # gunicorn --preload: load the embedder weights and graph arrays once in the master so
+    # workers share them copy-on-write; connections are still opened per worker in lifespan
+    from .embeddings import get_embedding_model
+    from .graph_loader import get_graph_loader
+
+    get_embedding_model()
+    get_graph_loader()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the RAG chain and warm the embedder before the first request is served."""
+    await asyncio.to_thread(warm_up_rag_components)
+    from . import graph_rag
+    if graph_rag.graph_rag_chain is None:
+        # Runs here rather than at import so --preload masters and scripts don't pay for it
+        try:
+            await asyncio.to_thread(graph_rag.initialize_graph_rag)
+        except Exception as e:
+            print(f"⚠️ GraphRAG not ready at startup; it will be retried when needed. Error: {e}")
+    yield
+    await close_async_sagemaker_clients()
+    await close_async_embedding_clients()
+    RAG_EXECUTOR.shutdown(wait=False)
 
-app = FastAPI(title="Code Assistant API")
+
+app = FastAPI(title="Code Assistant API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Global variables to track indexing status
 indexing_in_progress = False
-indexing_output = []  # Store terminal output lines
+indexing_output = deque(maxlen=INDEX_LOG_MAX)  # Most recent terminal output lines
+indexing_output_total = 0  # Lines appended this run; the deque holds the last len(indexing_output)
 indexing_complete = False
+_output_changed: Optional[asyncio.Future] = None  # Resolved when a line is added or the run ends
 
 # Add CORS middleware for frontend connection
 # The persistent 400 Bad Request on OPTIONS suggests a conflict with the "*" wildcard.
@@ -42,6 +97,11 @@ class Question(BaseModel):
     use_graph_rag: bool = True  # Use GraphRAG by default
 
 
+class BatchQuestion(BaseModel):
+    questions: List[str]
+    use_graph_rag: bool = True
+
+
 class IndexRequest(BaseModel):
     codebase_path: str
     collection: Optional[str] = None
@@ -149,12 +209,44 @@ async def trigger_indexing(request: IndexRequest, background_tasks: BackgroundTa
     }
 
 
-def run_indexing_task(payload: dict):
+def _append_output(line: str):
+    global indexing_output_total
+    indexing_output.append(line)
+    indexing_output_total += 1
+    _signal_output()
+
+
+def _signal_output():
+    """Wake every /index/stream client waiting for new output."""
+    global _output_changed
+    if _output_changed is not None and not _output_changed.done():
+        _output_changed.set_result(None)
+    _output_changed = None
+
+
+def _wait_for_output() -> asyncio.Future:
+    global _output_changed
+    if _output_changed is None:
+        _output_changed = asyncio.get_running_loop().create_future()
+    return _output_changed
+
+
+def _output_since(since: int):
+    """Lines numbered >= since (clamped to what the buffer still holds) and the next line number."""
+    if since > indexing_output_total:
+        since = 0  # a new run started since the client's last read
+    first_kept = indexing_output_total - len(indexing_output)
+    start = max(since, first_kept) - first_kept
+    return list(islice(indexing_output, start, None)), indexing_output_total
+
+
+async def run_indexing_task(payload: dict):
     """Background task to run the indexing script"""
-    global indexing_in_progress, indexing_output, indexing_complete
+    global indexing_in_progress, indexing_complete, indexing_output_total
     
     try:
-        indexing_output = []
+        indexing_output.clear()
+        indexing_output_total = 0
         indexing_complete = False
         
         start_msg = (
@@ -164,7 +256,7 @@ def run_indexing_task(payload: dict):
             f"{'='*60}"
         )
         print(start_msg)
-        indexing_output.append(start_msg)
+        _append_output(start_msg)
         
         cmd = [
             "python3.9",
@@ -176,85 +268,131 @@ def run_indexing_task(payload: dict):
             "--output", payload["output"],
         ]
         
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            cwd=os.getcwd()
+        # Read the indexer's output on the event loop so no threadpool worker is held for the run
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            cwd=os.getcwd(),
+            # A piped stdout is block-buffered; unbuffered output reaches /index/stream line by line
+            env={**os.environ, "PYTHONUNBUFFERED": "1"},
+            limit=INDEX_STREAM_LIMIT,
         )
-        
-        for line in process.stdout:
-            line = line.rstrip()
-            if line:
-                print(line)
-                indexing_output.append(line)
-        
-        process.wait()
+
+        async def collect_output():
+            async for raw_line in process.stdout:
+                line = raw_line.decode("utf-8", errors="replace").rstrip()[:INDEX_LOG_LINE_MAX]
+                if line:
+                    print(line)
+                    _append_output(line)
+            await process.wait()
+
+        try:
+            await asyncio.wait_for(collect_output(), timeout=INDEX_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"timed out after {INDEX_TIMEOUT}s; indexer process killed")
+        finally:
+            # Whatever stopped the read (timeout, an over-long line, cancellation), don't leave the indexer running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
         
         if process.returncode == 0:
             success_msg = "\n✅ Indexing completed successfully!"
             print(success_msg)
-            indexing_output.append(success_msg)
+            _append_output(success_msg)
             indexing_complete = True
+            # Cached answers (and the flat index copy) still reflect the old chunks and ids
+            await asyncio.to_thread(refresh_rag_retrieval)
+            refresh_graph_rag_retrieval()
         else:
             error_msg = f"\n❌ Indexing failed with exit code {process.returncode}"
             print(error_msg)
-            indexing_output.append(error_msg)
+            _append_output(error_msg)
             
     except Exception as e:
         error_msg = f"\n❌ Indexing error: {e}"
         print(error_msg)
-        indexing_output.append(error_msg)
+        _append_output(error_msg)
     finally:
         indexing_in_progress = False
+        _signal_output()
 
 @app.get("/index/status")
-def indexing_status():
+async def indexing_status():
     """Check if indexing is in progress and get status"""
     global indexing_in_progress, indexing_complete
     return {
         "in_progress": indexing_in_progress,
         "completed": indexing_complete,
-        "output_lines": len(indexing_output),
+        "output_lines": indexing_output_total,
     }
 
 @app.get("/index/output")
-def get_indexing_output():
-    """Get the current indexing output"""
-    global indexing_output
+async def get_indexing_output(since: int = 0):
+    """Get the indexing output; pass the previous response's `next` as `since` to get only new lines"""
+    lines, next_line = _output_since(since)
     return {
-        "output": indexing_output,
+        "output": lines,
+        "next": next_line,
         "in_progress": indexing_in_progress,
         "completed": indexing_complete,
     }
 
+@app.get("/index/stream")
+async def stream_indexing_output(since: int = 0):
+    """Stream indexing output as server-sent events, one event per new line"""
+
+    async def events():
+        next_line = since
+        while True:
+            lines, next_line = _output_since(next_line)
+            for line in lines:
+                yield f"data: {json.dumps(line)}\n\n"
+            if not indexing_in_progress:
+                yield f"event: done\ndata: {json.dumps({'completed': indexing_complete})}\n\n"
+                return
+            try:
+                # shield: a keepalive timeout must not cancel the future other clients share
+                await asyncio.wait_for(asyncio.shield(_wait_for_output()), timeout=INDEX_STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+def _strip_source_content(result: dict) -> dict:
+    """Drop inline chunk text from sources; clients fetch it from /source/{doc_id} on demand."""
+    for source in result.get("sources") or []:
+        source.pop("content", None)
+    return result
+
 @app.post("/ask")
-async def ask_question(q: Question):
+async def ask_question(q: Question, include_content: bool = False):
     """Ask a question about the indexed codebase using GraphRAG or standard RAG"""
     try:
         # A check to ensure Pydantic model parsing succeeded
         if not q.question:
              raise ValueError("Question field is empty in the request body.")
 
+        loop = asyncio.get_running_loop()
+
         # Use GraphRAG by default, fallback to standard RAG
         if q.use_graph_rag:
             try:
-                result = get_graph_rag_answer(q.question)
+                result = await loop.run_in_executor(RAG_EXECUTOR, get_graph_rag_answer, q.question)
                 result["method"] = "graph_rag"
                 result["provider"] = get_current_provider()
             except Exception as graph_error:
                 print(f"⚠️ GraphRAG failed, falling back to standard RAG: {graph_error}")
-                result = get_answer(q.question)
+                result = await loop.run_in_executor(RAG_EXECUTOR, get_answer, q.question)
                 result["method"] = "rag"
                 result["provider"] = get_current_provider()
         else:
-            result = get_answer(q.question)
+            result = await aget_answer(q.question)
             result["method"] = "rag"
             result["provider"] = get_current_provider()
 
-        return result
+        return result if include_content else _strip_source_content(result)
     except Exception as e:
         # Log the error for debugging purposes in the terminal
         print(f"--- ERROR PROCESSING /ASK REQUEST ---")
@@ -263,6 +401,61 @@ async def ask_question(q: Question):
         print(f"---------------------------------------")
         return {"error": str(e)}
 
+@app.post("/ask/stream")
+async def ask_question_stream(q: Question, include_content: bool = False):
+    """Ask a question with standard RAG and stream the answer as server-sent events"""
+    if not q.question:
+        raise HTTPException(status_code=400, detail="Question field is empty in the request body.")
+
+    async def events():
+        try:
+            async for event in get_answer_stream(q.question):
+                if not include_content:
+                    _strip_source_content(event)
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"--- ERROR STREAMING /ASK/STREAM RESPONSE: {type(e).__name__}: {e}")
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/ask/batch")
+async def ask_questions(q: BatchQuestion, include_content: bool = False):
+    """Ask several questions in one request; retrieval and generation are pipelined across the batch"""
+    try:
+        if not q.questions or not all(q.questions):
+            raise ValueError("Questions list is empty or contains an empty question.")
+
+        if q.use_graph_rag:
+            results = await get_graph_rag_answers(q.questions)
+            method = "graph_rag"
+        else:
+            results = await get_answers(q.questions)
+            method = "rag"
+
+        provider = get_current_provider()
+        for result in results:
+            result["method"] = method
+            result["provider"] = provider
+            if not include_content:
+                _strip_source_content(result)
+        return {"results": results}
+    except Exception as e:
+        print(f"--- ERROR PROCESSING /ASK/BATCH REQUEST ---")
+        print(f"Error Type: {type(e).__name__}")
+        print(f"Error Detail: {e}")
+        print(f"---------------------------------------")
+        return {"error": str(e)}
+
+@app.get("/source/{doc_id}")
+def get_source(doc_id: str):
+    """Fetch the full text of one retrieved chunk by the id returned in /ask sources."""
+    document = get_document(doc_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail=f"Document not found: {doc_id}")
+    return document
+
 @app.get("/debug/docs")
 def debug_document_list():
     """Lists the source metadata for all documents currently in the vector store."""
@@ -282,7 +475,7 @@ def set_llm_provider(provider: str):
             detail="Provider must be 'ollama', 'vertex', 'sagemaker', or 'openai'",
         )
     
-    reset_llm()
+    # LLM instances are cached per provider, so switching back reuses the existing client
     os.environ["LLM_PROVIDER"] = provider.lower()
     
     # Re-initialize GraphRAG with new provider
@@ -1,20 +1,30 @@
-import json
+import asyncio
 import os
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set
 
 import boto3
+import orjson
 from botocore.config import Config
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.language_models import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
 
-LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "chroma_db")
-LOCAL_COLLECTION_NAME = os.getenv("LOCAL_COLLECTION_NAME", "code_assistant_local")
-LOCAL_EMBEDDING_MODEL = os.getenv(
-    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
-)
+from .embeddings import get_embedding_model as _get_embedding_model
+from .vectorstore import LOCAL_COLLECTION_NAME, create_vectorstore, load_flat_index, vectorstore_location
+
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session as get_aio_session
+except ImportError:
+    # Optional: without aiobotocore, async SageMaker calls run the boto3 client in a thread
+    AioConfig = None
+
+RAG_K = int(os.getenv("RAG_K", "10"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
 
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 SAGEMAKER_ENDPOINT_NAME = os.getenv("SAGEMAKER_ENDPOINT_NAME")
@@ -24,11 +34,92 @@ SAGEMAKER_MAX_NEW_TOKENS = int(os.getenv("SAGEMAKER_MAX_NEW_TOKENS", "512"))
 SAGEMAKER_TEMPERATURE = float(os.getenv("SAGEMAKER_TEMPERATURE", "0.2"))
 SAGEMAKER_TOP_P = float(os.getenv("SAGEMAKER_TOP_P", "0.9"))
 SAGEMAKER_STOP_SEQUENCE = os.getenv("SAGEMAKER_STOP_SEQUENCE", "")
+SAGEMAKER_POOL = int(os.getenv("SAGEMAKER_POOL", "32"))  # HTTPS connections kept open to the endpoint
+SAGEMAKER_MAX_BATCH = int(os.getenv("SAGEMAKER_MAX_BATCH", "1"))  # >1 coalesces concurrent prompts
+SAGEMAKER_BATCH_WINDOW_MS = int(os.getenv("SAGEMAKER_BATCH_WINDOW_MS", "20"))
+RAG_PREFETCH = int(os.getenv("RAG_PREFETCH", "2"))  # retrievals allowed to run ahead of generation
+RAG_MAX_CONCURRENCY = int(os.getenv("RAG_MAX_CONCURRENCY", "8"))  # async RAG answers generated at once
+SOURCES_PAGE_SIZE = 5000  # chunk metadata rows fetched per /debug/docs page
+RAG_INIT_RETRY_INTERVAL = 30  # seconds before a failed on-demand initialization is tried again
 
 vectorstore = None
+_flat_index = None  # in-memory copy of a small collection (FLAT_INDEX_MAX)
 rag_chain = None
-_local_embedder = None
 _remote_llm = None
+_sources_cache = None  # (collection count, sources) from the last /debug/docs listing
+_init_lock = threading.Lock()
+_init_failed_at = None  # monotonic time of the last failed on-demand initialization
+_sagemaker_clients: Dict[str, Any] = {}
+_sagemaker_client_lock = threading.Lock()
+_async_sagemaker_clients: Dict[Any, Any] = {}  # (event loop, region) -> (client context, aiobotocore client)
+_sagemaker_batchers: Dict[Any, Any] = {}  # (event loop, endpoint, region) -> _SageMakerBatcher
+_rag_semaphores: Dict[Any, asyncio.Semaphore] = {}  # event loop -> RAG_MAX_CONCURRENCY limiter
+
+_SAGEMAKER_CLIENT_SETTINGS = {
+    "retries": {"max_attempts": 3, "mode": "adaptive"},
+    "max_pool_connections": SAGEMAKER_POOL,
+    "read_timeout": 120,
+    "connect_timeout": 5,
+}
+
+
+def _get_sagemaker_client(region_name: str, client_kwargs: Optional[Dict[str, Any]] = None):
+    """Get the shared sagemaker-runtime client for a region (dedicated if client_kwargs are given)."""
+    client_config = Config(tcp_keepalive=True, **_SAGEMAKER_CLIENT_SETTINGS)
+    if client_kwargs:
+        return boto3.client("sagemaker-runtime", region_name=region_name, config=client_config, **client_kwargs)
+
+    with _sagemaker_client_lock:
+        if region_name not in _sagemaker_clients:
+            _sagemaker_clients[region_name] = boto3.client(
+                "sagemaker-runtime", region_name=region_name, config=client_config
+            )
+        return _sagemaker_clients[region_name]
+
+
+async def _get_async_sagemaker_client(region_name: str):
+    """Get the aiobotocore sagemaker-runtime client for this event loop and region."""
+    key = (asyncio.get_running_loop(), region_name)
+    if key not in _async_sagemaker_clients:
+        context = get_aio_session().create_client(
+            "sagemaker-runtime", region_name=region_name, config=AioConfig(**_SAGEMAKER_CLIENT_SETTINGS)
+        )
+        client = await context.__aenter__()
+        if key in _async_sagemaker_clients:
+            # Another coroutine opened one while this client was connecting
+            await context.__aexit__(None, None, None)
+        else:
+            _async_sagemaker_clients[key] = (context, client)
+    return _async_sagemaker_clients[key][1]
+
+
+async def close_async_sagemaker_clients():
+    """Close the aiobotocore clients opened on the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _sagemaker_batchers if key[0] is loop]:
+        _sagemaker_batchers.pop(key).close()
+    for key in [key for key in _async_sagemaker_clients if key[0] is loop]:
+        context, _ = _async_sagemaker_clients.pop(key)
+        await context.__aexit__(None, None, None)
+
+
+def _reset_after_fork():
+    """Give a forked worker (gunicorn --preload) its own SageMaker connections and chain."""
+    global _sagemaker_client_lock, _init_lock, _init_failed_at, _remote_llm, vectorstore, rag_chain
+    _sagemaker_client_lock = threading.Lock()
+    _init_lock = threading.Lock()
+    _init_failed_at = None
+    _sagemaker_clients.clear()
+    _async_sagemaker_clients.clear()
+    _sagemaker_batchers.clear()
+    _rag_semaphores.clear()
+    # These hold the parent's connections; the worker's lifespan warm-up rebuilds them
+    _remote_llm = None
+    vectorstore = None
+    rag_chain = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
 
 
 class SageMakerServerlessLLM(LLM):
@@ -46,23 +137,13 @@ class SageMakerServerlessLLM(LLM):
 
     def __init__(self, **kwargs: Any):
         super().__init__(**kwargs)
-        client_config = Config(
-            retries={"max_attempts": 3, "mode": "standard"},
-            read_timeout=120,
-            connect_timeout=10,
-        )
-        self._client = boto3.client(
-            "sagemaker-runtime",
-            region_name=self.region_name,
-            config=client_config,
-            **(self.client_kwargs or {}),
-        )
+        self._client = _get_sagemaker_client(self.region_name, self.client_kwargs)
 
     @property
     def _llm_type(self) -> str:
         return "sagemaker_serverless"
 
-    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+    def _build_payload(self, prompt: str, stop: Optional[List[str]], **kwargs: Any) -> dict:
         payload = {
             "inputs": prompt,
             "parameters": {
@@ -77,16 +158,45 @@ class SageMakerServerlessLLM(LLM):
             payload["parameters"]["stop_sequences"] = list(
                 set(payload["parameters"].get("stop_sequences", []) + stop)
             )
+        return payload
 
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
+        payload = self._build_payload(prompt, stop, **kwargs)
         response = self._client.invoke_endpoint(
             EndpointName=self.endpoint_name,
             ContentType=self.content_type,
             Accept=self.accept,
-            Body=json.dumps(payload).encode("utf-8"),
+            Body=orjson.dumps(payload),
         )
 
-        body_str = response["Body"].read().decode("utf-8")
-        text = self._extract_text(body_str)
+        return self._finish_text(self._extract_text(response["Body"].read().decode("utf-8")), stop)
+
+    async def _acall(
+        self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any
+    ) -> str:
+        """Invoke the endpoint without holding a thread for the round trip (needs aiobotocore)."""
+        if AioConfig is None or self.client_kwargs:
+            return await super()._acall(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+        payload = self._build_payload(prompt, stop, **kwargs)
+        if SAGEMAKER_MAX_BATCH > 1:
+            text = await _get_sagemaker_batcher(self).submit(payload)
+        else:
+            text = self._extract_text(await self._ainvoke_endpoint(payload))
+        return self._finish_text(text, stop)
+
+    async def _ainvoke_endpoint(self, payload: dict) -> str:
+        client = await _get_async_sagemaker_client(self.region_name)
+        response = await client.invoke_endpoint(
+            EndpointName=self.endpoint_name,
+            ContentType=self.content_type,
+            Accept=self.accept,
+            Body=orjson.dumps(payload),
+        )
+        async with response["Body"] as body:
+            return (await body.read()).decode("utf-8")
+
+    def _finish_text(self, text: str, stop: Optional[List[str]]) -> str:
         if stop:
             text = self._enforce_stop_tokens(text, stop)
         return text.strip()
@@ -94,31 +204,227 @@ class SageMakerServerlessLLM(LLM):
     def _extract_text(self, body: str) -> str:
         """Best-effort parser for common HF/SageMaker response formats."""
         try:
-            data = json.loads(body)
-        except json.JSONDecodeError:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
             return body
 
+        text = self._extract_from_obj(data)
+        return body if text is None else text
+
+    @classmethod
+    def _extract_from_obj(cls, data: Any) -> Optional[str]:
+        """Pull the generated text out of an already-parsed response, or None."""
         if isinstance(data, dict):
             if "generated_text" in data:
                 return data["generated_text"]
             if "outputs" in data:
                 outputs = data["outputs"]
                 if isinstance(outputs, list) and outputs:
-                    return self._extract_text(json.dumps(outputs[0]))
+                    return cls._extract_from_obj(outputs[0])
         elif isinstance(data, list) and data:
             first = data[0]
             if isinstance(first, dict) and "generated_text" in first:
                 return first["generated_text"]
             if isinstance(first, str):
                 return first
-        return body
+        return None
+
+    def _stream(
+        self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any
+    ) -> Iterator[GenerationChunk]:
+        """Yield text deltas as the endpoint produces them, cut at the first stop token."""
+        payload = self._build_payload(prompt, stop, **kwargs)
+        payload["stream"] = True
+        response = self._client.invoke_endpoint_with_response_stream(
+            EndpointName=self.endpoint_name,
+            ContentType=self.content_type,
+            Accept=self.accept,
+            Body=orjson.dumps(payload),
+        )
+
+        stop_tokens = [token for token in (stop or []) if token]
+        # Hold back enough trailing text to catch a stop token split across deltas
+        hold = max((len(token) for token in stop_tokens), default=1) - 1
+        pending = ""
+        for delta in self._iter_stream_deltas(response["Body"]):
+            pending += delta
+            cut = self._find_stop(pending, stop_tokens)
+            if cut >= 0:
+                if cut:
+                    yield GenerationChunk(text=pending[:cut])
+                return
+            ready = len(pending) - hold
+            if ready > 0:
+                yield GenerationChunk(text=pending[:ready])
+                pending = pending[ready:]
+        if pending:
+            yield GenerationChunk(text=pending)
 
     @staticmethod
-    def _enforce_stop_tokens(text: str, stop_tokens: List[str]) -> str:
+    def _iter_stream_deltas(event_stream) -> Iterator[str]:
+        """Reassemble PayloadPart bytes into lines and pull out each token's text."""
+        buffer = b""
+        for event in event_stream:
+            buffer += event.get("PayloadPart", {}).get("Bytes", b"")
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line = line.strip()
+                if line.startswith(b"data:"):
+                    line = line[5:].strip()
+                if not line:
+                    continue
+                try:
+                    data = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                # TGI-style token events; the final event also repeats the full generated_text
+                token = data.get("token") if isinstance(data, dict) else None
+                if isinstance(token, dict):
+                    if not token.get("special"):
+                        yield token.get("text", "")
+                elif isinstance(data, dict) and data.get("generated_text"):
+                    yield data["generated_text"]
+
+    @staticmethod
+    def _find_stop(text: str, stop_tokens: List[str]) -> int:
+        """Index of the earliest stop token in text, or -1."""
+        cut = len(text)
         for token in stop_tokens:
-            if token and token in text:
-                text = text.split(token)[0]
-        return text
+            if token:
+                # Only look for matches that would start before the best cut so far
+                i = text.find(token, 0, cut + len(token) - 1)
+                if i >= 0:
+                    cut = i
+        return cut if cut < len(text) else -1
+
+    @classmethod
+    def _enforce_stop_tokens(cls, text: str, stop_tokens: List[str]) -> str:
+        cut = cls._find_stop(text, stop_tokens)
+        return text if cut < 0 else text[:cut]
+
+class _SageMakerBatcher:
+    """Coalesces concurrent prompts into one invoke_endpoint call with a list of inputs."""
+
+    def __init__(self, llm: SageMakerServerlessLLM):
+        self.llm = llm
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Cleared for good the first time the container rejects or mis-answers a list input;
+        # throttling, timeouts and dropped connections only affect the batch they hit
+        self.batching_supported = True
+        # The loop only keeps weak references to tasks, so in-flight dispatches are held here
+        self._dispatches: Set[asyncio.Task] = set()
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, payload: dict) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, future))
+        return await future
+
+    def close(self):
+        self.task.cancel()
+        for task in self._dispatches:
+            task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + SAGEMAKER_BATCH_WINDOW_MS / 1000
+            while len(batch) < SAGEMAKER_MAX_BATCH:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+
+            # Only prompts with identical generation parameters can share a request
+            groups: Dict[bytes, list] = {}
+            for payload, future in batch:
+                key = orjson.dumps(payload["parameters"], option=orjson.OPT_SORT_KEYS)
+                groups.setdefault(key, []).append((payload, future))
+            for group in groups.values():
+                task = asyncio.create_task(self._dispatch(group))
+                self._dispatches.add(task)
+                task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, group: list):
+        try:
+            await self._send(group)
+        except asyncio.CancelledError:
+            # Shutdown: release the callers instead of leaving them waiting forever
+            for _, future in group:
+                future.cancel()
+            raise
+
+    async def _send(self, group: list):
+        if len(group) > 1 and self.batching_supported:
+            texts = await self._invoke_batch([payload for payload, _ in group])
+            if texts is not None:
+                for (_, future), text in zip(group, texts):
+                    if not future.done():
+                        future.set_result(text)
+                return
+
+        async def single(payload: dict, future: asyncio.Future):
+            try:
+                text = self.llm._extract_text(await self.llm._ainvoke_endpoint(payload))
+                if not future.done():
+                    future.set_result(text)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        await asyncio.gather(*(single(payload, future) for payload, future in group))
+
+    async def _invoke_batch(self, payloads: List[dict]) -> Optional[List[str]]:
+        """Send all prompts as one list input; None if the container can't batch."""
+        batch_payload = {**payloads[0], "inputs": [payload["inputs"] for payload in payloads]}
+        try:
+            body = await self.llm._ainvoke_endpoint(batch_payload)
+        except Exception as e:
+            if not _rejects_input(e):
+                print(f"⚠️ SageMaker batch call failed ({e}); sending this batch's prompts individually")
+                return None
+            print(f"⚠️ SageMaker endpoint rejected a batched input ({e}); sending prompts individually from now on")
+            self.batching_supported = False
+            return None
+
+        try:
+            data = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            data = None
+        if isinstance(data, list) and len(data) == len(payloads):
+            texts = [item if isinstance(item, str) else self.llm._extract_from_obj(item) for item in data]
+            if all(isinstance(text, str) for text in texts):
+                return texts
+        print("⚠️ SageMaker endpoint returned an unexpected shape for a batched input; sending prompts individually from now on")
+        self.batching_supported = False
+        return None
+
+
+_THROTTLING_ERROR_CODES = {"ThrottlingException", "Throttling", "TooManyRequestsException"}
+
+
+def _rejects_input(error: Exception) -> bool:
+    """True for a 4xx answer to the request itself (ValidationError, or a container 4xx surfaced as ModelError)."""
+    response = getattr(error, "response", None)  # botocore ClientError; anything else is transient
+    if not isinstance(response, dict):
+        return False
+    code = response.get("Error", {}).get("Code")
+    if code in _THROTTLING_ERROR_CODES:
+        return False
+    if code == "ModelError":
+        status = response.get("OriginalStatusCode")
+    else:
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+def _get_sagemaker_batcher(llm: SageMakerServerlessLLM) -> _SageMakerBatcher:
+    key = (asyncio.get_running_loop(), llm.endpoint_name, llm.region_name)
+    if key not in _sagemaker_batchers:
+        _sagemaker_batchers[key] = _SageMakerBatcher(llm)
+    return _sagemaker_batchers[key]
+
 
 CODE_QA_TEMPLATE = """
 You are an expert software developer AI assistant. Your role is to answer questions about a codebase.
@@ -141,14 +447,6 @@ ANSWER:
 QA_PROMPT = PromptTemplate.from_template(CODE_QA_TEMPLATE)
 
 
-def _get_embedding_model():
-    global _local_embedder
-    if _local_embedder is None:
-        print(f"Loading Hugging Face embedding model: {LOCAL_EMBEDDING_MODEL}")
-        _local_embedder = HuggingFaceEmbeddings(model_name=LOCAL_EMBEDDING_MODEL)
-    return _local_embedder
-
-
 def _get_llm():
     global _remote_llm
     if SAGEMAKER_ENDPOINT_NAME is None:
@@ -174,52 +472,248 @@ def _get_llm():
 
 def initialize_rag_components():
     """Initializes the vector store and the RAG chain using local models."""
-    global vectorstore, rag_chain
+    global vectorstore, _flat_index, rag_chain, _sources_cache
 
+    _sources_cache = None
     embedding_model = _get_embedding_model()
-    vectorstore = Chroma(
-        persist_directory=LOCAL_VECTOR_STORE_PATH,
-        collection_name=LOCAL_COLLECTION_NAME,
-        embedding_function=embedding_model,
-    )
-    print(f"Vector store loaded from {LOCAL_VECTOR_STORE_PATH} (collection: {LOCAL_COLLECTION_NAME})")
+    vectorstore = create_vectorstore(embedding_model)
+    _flat_index = load_flat_index(vectorstore)
+    _retrieve.cache_clear()
+    print(f"Vector store loaded from {vectorstore_location()} (collection: {LOCAL_COLLECTION_NAME})")
+    if _flat_index is not None:
+        print(f"Serving retrieval from an in-memory flat index ({len(_flat_index)} chunks)")
+
+    _build_rag_chain()
+
+
+def _build_rag_chain():
+    """Build the streaming chain over the loaded vector store; fails fast if the LLM is not configured."""
+    global rag_chain
 
     llm = _get_llm()
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-
-    rag_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        chain_type_kwargs={"prompt": QA_PROMPT},
-        return_source_documents=True,
+
+    # Returns {"docs", "question", "answer"}; the prompt is built as soon as the
+    # top-k docs arrive, and astream emits the docs before the first answer token
+    rag_chain = RunnableParallel(docs=RunnableLambda(_retrieve_docs), question=RunnablePassthrough()).assign(
+        answer=RunnableLambda(_prompt_inputs) | QA_PROMPT | llm
     )
-    print("Local RAG chain initialized (k=10).")
+    print(f"Local RAG chain initialized (k={RAG_K}).")
+
+
+@lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)
+def _retrieve(question: str) -> tuple:
+    """Fetch the top-k chunks for a question (cached per question)."""
+    if _flat_index is not None:
+        return tuple(_flat_index.search(_get_embedding_model().embed_query(question), RAG_K))
+    return tuple(vectorstore.similarity_search(question, k=RAG_K))
+
+
+def refresh_retrieval():
+    """Drop cached retrievals and sources and re-copy the flat index after the collection was re-indexed."""
+    global _flat_index, _sources_cache
+    # A re-index can rename or edit files without changing the chunk count the listing is keyed on
+    _sources_cache = None
+    if vectorstore is not None:
+        _flat_index = load_flat_index(vectorstore)
+    _retrieve.cache_clear()
+
+
+def _retrieve_docs(question: str) -> list:
+    return list(_retrieve(question))
+
+
+def _format_docs(docs) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def _prompt_inputs(inputs: dict) -> dict:
+    return {"question": inputs["question"], "context": _format_docs(inputs["docs"])}
+
+
+def _build_prompt(question: str, docs) -> str:
+    return CODE_QA_TEMPLATE.format(question=question, context=_format_docs(docs))
+
+
+def warm_up_rag_components():
+    """Initialize the RAG chain at startup and page in the embedder and vector index."""
+    try:
+        initialize_rag_components()
+    except Exception as e:
+        print(
+            "\n--- CRITICAL RAG INITIALIZATION ERROR ---\n"
+            f"{e}\n"
+            "------------------------------------------\n"
+        )
+        return
+
+    try:
+        vectorstore.similarity_search("warmup", k=1)
+        print("Embedding model and vector index warmed up.")
+    except Exception as e:
+        print(f"⚠️ RAG warm-up query failed: {e}")
+
+
+def _get_rag_semaphore() -> asyncio.Semaphore:
+    """Per-event-loop limiter so a burst of async requests can't overrun the LLM endpoint."""
+    loop = asyncio.get_running_loop()
+    if loop not in _rag_semaphores:
+        _rag_semaphores[loop] = asyncio.Semaphore(RAG_MAX_CONCURRENCY)
+    return _rag_semaphores[loop]
+
+
+def _ensure_rag_chain() -> bool:
+    """Initialize the RAG chain if startup warm-up failed or was skipped (e.g. scripts)."""
+    global _init_failed_at
+    if rag_chain is not None:
+        return True
+    with _init_lock:
+        if rag_chain is not None:
+            return True
+        # A misconfigured LLM fails on every attempt, so don't retry on every request
+        if _init_failed_at is not None and time.monotonic() - _init_failed_at < RAG_INIT_RETRY_INTERVAL:
+            return False
+        try:
+            if vectorstore is None:
+                initialize_rag_components()
+            else:
+                _build_rag_chain()  # the store loaded fine; only the LLM step needs retrying
+        except Exception as e:
+            _init_failed_at = time.monotonic()
+            print(f"❌ RAG initialization failed: {e}")
+            return False
+        _init_failed_at = None
+        return True
+
+
+async def _aensure_rag_chain() -> bool:
+    """_ensure_rag_chain for the async paths; initialization loads models, so it runs off the event loop."""
+    if rag_chain is not None:
+        return True
+    return await asyncio.to_thread(_ensure_rag_chain)
+
+
+_NOT_INITIALIZED = {
+    "answer": "The RAG system is not initialized. Please check the backend terminal for errors.",
+    "sources": [],
+}
 
 
 def get_answer(question: str) -> dict:
-    if rag_chain is None:
-        return {
-            "answer": "The RAG system is not initialized. Please check the backend terminal for errors.",
-            "sources": [],
+    if not _ensure_rag_chain():
+        return dict(_NOT_INITIALIZED)
+
+    # Retrieve, format and call the LLM directly; the runnable chain is only needed for streaming
+    docs = _retrieve_docs(question)
+    answer = _get_llm().invoke(_build_prompt(question, docs))
+
+    return {"answer": answer, "sources": _format_sources(docs)}
+
+
+async def aget_answer(question: str) -> dict:
+    """Async get_answer: Chroma search and the SageMaker call run without pinning a worker thread."""
+    if not await _aensure_rag_chain():
+        return dict(_NOT_INITIALIZED)
+
+    docs = await asyncio.to_thread(_retrieve_docs, question)
+    prompt = _build_prompt(question, docs)
+    async with _get_rag_semaphore():
+        answer = await _get_llm().ainvoke(prompt)
+
+    return {"answer": answer, "sources": _format_sources(docs)}
+
+
+def _format_sources(docs) -> list:
+    basename = os.path.basename
+    return [
+        {
+            "source": basename((doc.metadata or {}).get("source") or "unknown"),
+            "id": getattr(doc, "id", None),
+            "chars": len(doc.page_content),
+            "content": doc.page_content,
         }
+        for doc in docs
+    ]
 
-    result = rag_chain.invoke({"query": question})
-    docs = result.get("source_documents", []) or []
-    sources = []
-    for doc in docs:
-        metadata = doc.metadata or {}
-        source_path = metadata.get("source") or "unknown"
-        sources.append(
-            {
-                "source": os.path.basename(source_path),
-                "content": doc.page_content,
-            }
-        )
 
+async def get_answer_stream(question: str) -> AsyncIterator[dict]:
+    """
+    Answer a question with standard RAG, yielding events as the LLM streams.
+
+    Yields one {"sources": [...]} event after retrieval, then {"token": str}
+    events for each generated text delta.
+    """
+    if not await _aensure_rag_chain():
+        yield {"token": _NOT_INITIALIZED["answer"]}
+        return
+
+    async with _get_rag_semaphore():
+        async for chunk in rag_chain.astream(question):
+            if "docs" in chunk:
+                yield {"sources": _format_sources(chunk["docs"])}
+            if "answer" in chunk:
+                yield {"token": chunk["answer"]}
+
+
+async def get_answers(questions: List[str]) -> List[dict]:
+    """
+    Answer several questions with the standard RAG pipeline.
+
+    Retrieval and generation run as two stages joined by a small queue, so the
+    next question's Chroma search overlaps the in-flight SageMaker calls.
+    """
+    if not await _aensure_rag_chain():
+        return [dict(_NOT_INITIALIZED) for _ in questions]
+
+    llm = _get_llm()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=RAG_PREFETCH)
+
+    async def retrieve():
+        try:
+            for index, question in enumerate(questions):
+                docs = await asyncio.to_thread(_retrieve_docs, question)
+                await queue.put((index, question, docs))
+        finally:
+            await queue.put(None)
+
+    async def generate(question, docs) -> dict:
+        prompt = _build_prompt(question, docs)
+        async with _get_rag_semaphore():
+            answer = await llm.ainvoke(prompt)
+        return {"answer": answer, "sources": _format_sources(docs)}
+
+    producer = asyncio.create_task(retrieve())
+    pending = {}
+    while (item := await queue.get()) is not None:
+        index, question, docs = item
+        pending[index] = asyncio.create_task(generate(question, docs))
+    try:
+        await producer
+    except Exception:
+        for task in pending.values():
+            task.cancel()
+        raise
+
+    results = []
+    for index in range(len(questions)):
+        try:
+            results.append(await pending[index])
+        except Exception as e:
+            results.append({"answer": f"Error generating answer: {e}", "sources": []})
+    return results
+
+
+def get_document(doc_id: str) -> Optional[dict]:
+    """Fetch one stored chunk by id, for clients that only received source metadata."""
+    if vectorstore is None:
+        return None
+    results = vectorstore._collection.get(ids=[doc_id], include=["documents", "metadatas"])
+    if not results.get("ids"):
+        return None
+    metadata = (results.get("metadatas") or [None])[0] or {}
     return {
-        "answer": result.get("result", "An unknown error occurred during retrieval."),
-        "sources": sources,
+        "id": doc_id,
+        "source": os.path.basename(metadata.get("source") or "unknown"),
+        "content": results["documents"][0],
     }
 
 
@@ -227,26 +721,28 @@ def list_all_document_sources() -> list:
     if vectorstore is None:
         return [{"error": "Vector store not initialized. Check terminal for loading errors."}]
 
+    global _sources_cache
     try:
-        ids = vectorstore._collection.get(limit=1000, include=['metadatas']).get('ids', [])
-        if not ids:
-            return []
-
-        results = vectorstore._collection.get(ids=ids, include=['metadatas'])
-        sources = []
-        for metadata in results.get('metadatas', []):
-            if metadata and 'source' in metadata:
-                sources.append({"source": os.path.basename(metadata['source'])})
-        return sources
+        # The listing only changes when documents are added or removed
+        count = vectorstore._collection.count()
+        if _sources_cache is not None and _sources_cache[0] == count:
+            return list(_sources_cache[1])
+
+        # One entry per file, paging through the metadata so large collections aren't materialized at once
+        basename = os.path.basename
+        names = set()
+        for offset in range(0, count, SOURCES_PAGE_SIZE):
+            results = vectorstore._collection.get(
+                limit=SOURCES_PAGE_SIZE, offset=offset, include=['metadatas']
+            )
+            names.update(
+                basename(metadata['source'])
+                for metadata in results.get('metadatas') or []
+                if metadata and 'source' in metadata
+            )
+        sources = [{"source": name} for name in sorted(names)]
+        _sources_cache = (count, sources)
+        return list(sources)
     except Exception as e:
         return [{"error": f"Error loading documents from vector store: {e}"}]
 
-
-try:
-    initialize_rag_components()
-except Exception as e:
-    print(
-        "\n--- CRITICAL RAG INITIALIZATION ERROR ---\n"
-        f"{e}\n"
-        "------------------------------------------\n"
-    )
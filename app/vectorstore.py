@@ -0,0 +1,99 @@
+"""
+Vector Store
+
+Creates the Chroma store shared by the RAG and GraphRAG chains. Runs Chroma
+embedded (persisted to LOCAL_VECTOR_STORE_PATH) by default, or connects to a
+Chroma server when CHROMA_HOST is set so the HNSW index lives outside the API
+process and indexing writes don't contend with queries.
+
+Small collections can also be copied into a FlatIndex for exact in-memory
+search, which is faster than an HNSW query at that size.
+"""
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", "chroma_db")
+LOCAL_COLLECTION_NAME = os.getenv("LOCAL_COLLECTION_NAME", "code_assistant_local")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+FLAT_INDEX_MAX = int(os.getenv("FLAT_INDEX_MAX", "0"))  # collections up to this size are searched in memory
+
+_chroma_client = None
+
+
+def _get_chroma_client():
+    """Get or create the pooled HTTP client for the Chroma server."""
+    global _chroma_client
+    if _chroma_client is None:
+        import chromadb
+
+        _chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    return _chroma_client
+
+
+def vectorstore_location() -> str:
+    """Where the vector store lives, for log messages."""
+    return f"http://{CHROMA_HOST}:{CHROMA_PORT}" if CHROMA_HOST else LOCAL_VECTOR_STORE_PATH
+
+
+def create_vectorstore(embedding_function) -> Chroma:
+    """Open the code collection, on the Chroma server if configured."""
+    if CHROMA_HOST:
+        return Chroma(
+            client=_get_chroma_client(),
+            collection_name=LOCAL_COLLECTION_NAME,
+            embedding_function=embedding_function,
+        )
+    return Chroma(
+        persist_directory=LOCAL_VECTOR_STORE_PATH,
+        collection_name=LOCAL_COLLECTION_NAME,
+        embedding_function=embedding_function,
+    )
+
+
+class FlatIndex:
+    """Exact cosine search over an in-memory copy of a collection's embeddings."""
+
+    def __init__(self, ids: List[str], documents: List[str], metadatas: List[dict], embeddings):
+        self._ids = ids
+        self._documents = documents
+        self._metadatas = metadatas
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._matrix = matrix / norms
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(self, embedding: List[float], k: int) -> List[Document]:
+        """Top-k chunks by cosine similarity, best first."""
+        k = min(k, len(self._ids))
+        if k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = self._matrix @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Document(page_content=self._documents[i], metadata=self._metadatas[i] or {}, id=self._ids[i])
+            for i in top
+        ]
+
+
+def load_flat_index(vectorstore: Chroma) -> Optional[FlatIndex]:
+    """Copy the collection into a FlatIndex if it is enabled and the collection is small enough."""
+    if FLAT_INDEX_MAX <= 0:
+        return None
+    collection = vectorstore._collection
+    if collection.count() > FLAT_INDEX_MAX:
+        return None
+    data = collection.get(include=["documents", "metadatas", "embeddings"])
+    if not data["ids"]:
+        return None
+    return FlatIndex(data["ids"], data["documents"], data["metadatas"], data["embeddings"])
@@ -3,14 +3,17 @@ Google Cloud Vertex AI LLM Wrapper
 
 Provides LangChain-compatible LLM interface for Qwen models on Vertex AI.
 """
+import asyncio
 import os
 import json
 from typing import Any, Dict, List, Optional
 
+from pydantic import PrivateAttr
+
 try:
     from google.cloud import aiplatform
     from langchain_core.language_models import LLM
-    from langchain_core.callbacks import CallbackManagerForLLMRun
+    from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 except ImportError:
     print("⚠️ google-cloud-aiplatform not installed. Install with: pip install google-cloud-aiplatform")
     aiplatform = None
@@ -28,6 +31,8 @@ class VertexAIQwenLLM(LLM):
     top_p: float = 0.9
     top_k: int = 40
 
+    _model: Any = PrivateAttr(default=None)
+
     def __init__(self, **kwargs: Any):
         if aiplatform is None:
             raise ImportError(
@@ -41,6 +46,34 @@ class VertexAIQwenLLM(LLM):
     def _llm_type(self) -> str:
         return "vertex_ai_qwen"
 
+    def _get_model(self):
+        """Load the model handle once; it keeps its prediction client and channel for reuse."""
+        if self._model is None:
+            from vertexai.preview.language_models import TextGenerationModel
+
+            self._model = TextGenerationModel.from_pretrained(self.model_name)
+        return self._model
+
+    def _parameters(self, stop: Optional[List[str]], **kwargs: Any) -> Dict[str, Any]:
+        parameters = {
+            "temperature": kwargs.get("temperature", self.temperature),
+            "max_output_tokens": kwargs.get("max_output_tokens", self.max_output_tokens),
+            "top_p": kwargs.get("top_p", self.top_p),
+            "top_k": kwargs.get("top_k", self.top_k),
+        }
+        if stop:
+            parameters["stop_sequences"] = stop
+        return parameters
+
+    @staticmethod
+    def _finish_text(response: Any, stop: Optional[List[str]]) -> str:
+        text = response.text if hasattr(response, "text") else str(response)
+        if stop:
+            for stop_token in stop:
+                if stop_token in text:
+                    text = text.split(stop_token)[0]
+        return text.strip()
+
     def _call(
         self,
         prompt: str,
@@ -49,34 +82,26 @@ class VertexAIQwenLLM(LLM):
         **kwargs: Any,
     ) -> str:
         """Call the Vertex AI model."""
-        from vertexai.preview.language_models import TextGenerationModel
-
         try:
-            model = TextGenerationModel.from_pretrained(self.model_name)
-
-            parameters = {
-                "temperature": kwargs.get("temperature", self.temperature),
-                "max_output_tokens": kwargs.get("max_output_tokens", self.max_output_tokens),
-                "top_p": kwargs.get("top_p", self.top_p),
-                "top_k": kwargs.get("top_k", self.top_k),
-            }
-
-            if stop:
-                parameters["stop_sequences"] = stop
-
-            response = model.predict(
-                prompt,
-                **parameters,
-            )
-
-            text = response.text if hasattr(response, "text") else str(response)
-            if stop:
-                for stop_token in stop:
-                    if stop_token in text:
-                        text = text.split(stop_token)[0]
-
-            return text.strip()
+            response = self._get_model().predict(prompt, **self._parameters(stop, **kwargs))
+            return self._finish_text(response, stop)
+        except Exception as e:
+            error_msg = f"Vertex AI API error: {e}"
+            print(f"❌ {error_msg}")
+            raise RuntimeError(error_msg) from e
 
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Call the Vertex AI model over the async prediction client."""
+        try:
+            model = self._model or await asyncio.to_thread(self._get_model)
+            response = await model.predict_async(prompt, **self._parameters(stop, **kwargs))
+            return self._finish_text(response, stop)
         except Exception as e:
             error_msg = f"Vertex AI API error: {e}"
             print(f"❌ {error_msg}")
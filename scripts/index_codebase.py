@@ -5,10 +5,14 @@ This version works offline using HuggingFace sentence-transformers
 """
 import os
 import sys
+import json
+import hashlib
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter, Language
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
@@ -21,7 +25,21 @@ DEFAULT_CHROMA_PATH = "./chroma_db"
 DEFAULT_COLLECTION_NAME = "code_assistant_local"
 DEFAULT_CHUNK_SIZE = 1000
 DEFAULT_CHUNK_OVERLAP = 100
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024  # larger files are skipped (minified bundles, lockfiles)
 DEFAULT_EMBED_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "128"))  # texts per model forward pass
+WRITE_BATCH_SIZE = int(os.getenv("INDEX_WRITE_BATCH_SIZE", "8192"))  # chunks per Chroma write
+MIN_CHUNK_CHARS = int(os.getenv("INDEX_MIN_CHUNK_CHARS", "40"))  # shorter chunks carry no signal worth embedding
+READ_THREADS = 8  # concurrent file reads per worker task
+SHARD_FILES = 256  # files per load-and-split task; large language groups span several workers
+# Same settings as the API's embedder, so documents and queries come from the same runtime
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")  # torch | onnx (CPU only)
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+# When set, chunks are written to this Chroma server instead of the --output directory
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+# Vectors from different models or runtimes must never share ids, so this is hashed into each chunk id
+EMBED_SIGNATURE = f"{DEFAULT_EMBED_MODEL}|{f'onnx:{EMBED_ONNX_FILE}' if EMBED_BACKEND == 'onnx' else 'torch'}"
 
 # Define source extensions
 SOURCE_EXTENSIONS = [
@@ -42,120 +60,318 @@ LANGUAGE_MAPPING = {
     ("js", "jsx", "ts", "tsx"): Language.JS,
     ("swift", "m", "h", "plist"): Language.SWIFT,
     ("kt", "java", "gradle", "xml"): Language.KOTLIN,
-    ("py"): Language.PYTHON,
+    ("py",): Language.PYTHON,
     ("json", "yaml", "md", "config"): Language.JS
 }
+EXT_TO_GROUP = {ext: extensions for extensions in LANGUAGE_MAPPING for ext in extensions}
 
-def should_exclude_path(path: str) -> bool:
-    """Check if a path should be excluded"""
-    path_parts = os.path.normpath(path).split(os.sep)
-    return any(exclude_dir in path_parts for exclude_dir in EXCLUDE_DIRS)
+def scan_source_files(directory: str, max_file_bytes: int = DEFAULT_MAX_FILE_BYTES):
+    """
+    Walk the tree once, bucketing files by LANGUAGE_MAPPING group.
 
-def load_and_split_code(directory: str, chunk_size: int = 1000, chunk_overlap: int = 100):
-    """Load and split code files"""
-    all_chunks = []
-    excluded_count = 0
+    Empty files and files over max_file_bytes (0 for no limit) are left out.
+    Returns (files, stats, skipped_dirs, skipped_files).
+    """
+    files = {extensions: [] for extensions in LANGUAGE_MAPPING}
+    stats = {}  # path -> [mtime_ns, size]
+    skipped_dirs = skipped_files = 0
+    stack = [directory]
 
-    for extensions, lang_constant in LANGUAGE_MAPPING.items():
-        documents = []
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError as e:
+            print(f"Warning: Cannot read directory: {e}")
+            continue
+        for entry in entries:
+            # Hidden entries are skipped, as DirectoryLoader did
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name in EXCLUDE_DIRS:
+                    skipped_dirs += 1
+                else:
+                    stack.append(entry.path)
+            elif entry.is_file():
+                group = EXT_TO_GROUP.get(os.path.splitext(entry.name)[1][1:])
+                if group is None:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # Minified bundles and lockfiles only yield noise chunks, so they are never opened
+                if stat.st_size == 0 or (max_file_bytes and stat.st_size > max_file_bytes):
+                    skipped_files += 1
+                    continue
+                files[group].append(entry.path)
+                stats[entry.path] = [stat.st_mtime_ns, stat.st_size]
 
-        for ext in extensions:
-            glob_pattern = f"**/*.{ext}"
+    for paths in files.values():
+        paths.sort()
+    return files, stats, skipped_dirs, skipped_files
 
-            try:
-                loader = DirectoryLoader(
-                    directory, glob=glob_pattern, recursive=True,
-                    loader_cls=TextLoader, 
-                    loader_kwargs={"encoding": "utf-8"},
-                    silent_errors=True,
-                    show_progress=False
-                )
-                loaded_docs = loader.load()
-                
-                filtered_docs = []
-                for doc in loaded_docs:
-                    source_path = doc.metadata.get('source', '')
-                    if should_exclude_path(source_path):
-                        excluded_count += 1
-                    else:
-                        filtered_docs.append(doc)
-                
-                documents.extend(filtered_docs)
-            except Exception as e:
-                print(f"Warning: Error loading {ext} files: {e}")
-                continue
+def manifest_path(output: str, collection_name: str) -> str:
+    """Per-collection record of indexed files, kept next to the local store (or per Chroma server)"""
+    if CHROMA_HOST:
+        return os.path.join(output, f"{CHROMA_HOST}_{CHROMA_PORT}.{collection_name}.manifest.json")
+    return os.path.join(output, f"{collection_name}.manifest.json")
 
-        if not documents:
-            continue
+def load_manifest(path: str, chunk_size: int, chunk_overlap: int):
+    """
+    Files indexed by the last run: path -> {"stat", "ids"}.
 
-        splitter = RecursiveCharacterTextSplitter.from_language(
-            language=lang_constant,
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap
-        )
+    Returns (files, reusable). Files are only reusable when the last run used the
+    same chunking and embedding model; otherwise their ids are still needed to
+    remove the old chunks.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}, False
+    reusable = (
+        data.get("chunk_size") == chunk_size
+        and data.get("chunk_overlap") == chunk_overlap
+        and data.get("embed") == EMBED_SIGNATURE
+    )
+    return data.get("files", {}), reusable
 
-        chunks = splitter.split_documents(documents)
-        all_chunks.extend(chunks)
-        print(f"✓ Loaded {len(documents)} files for {lang_constant.name}. Created {len(chunks)} chunks.")
+def save_manifest(path: str, chunk_size: int, chunk_overlap: int, files: dict):
+    """Write the manifest atomically so an interrupted run leaves the previous one intact"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "embed": EMBED_SIGNATURE, "files": files}, f)
+    os.replace(tmp_path, path)
+
+@lru_cache(maxsize=None)
+def _get_splitter(lang_constant, chunk_size: int, chunk_overlap: int):
+    """One splitter per language and size, reused by every group a worker handles"""
+    return RecursiveCharacterTextSplitter.from_language(
+        language=lang_constant,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+def _read_source(path: str):
+    """Read one file as a Document, or None if it can't be read as UTF-8"""
+    try:
+        # One raw read and one decode; text mode would decode incrementally through TextIOWrapper
+        with open(path, "rb") as f:
+            text = f.read().decode("utf-8")
+    except (OSError, UnicodeDecodeError):
+        return None
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")  # text mode's newline translation
+    return Document(page_content=text, metadata={"source": path})
+
+def _load_split_one(paths, lang_constant, chunk_size: int, chunk_overlap: int):
+    """Read and split a shard of one language group's files; returns (chunks, file_count)"""
+    # File reads are I/O-bound, so a few threads per worker keep the disk busy
+    with ThreadPoolExecutor(max_workers=min(READ_THREADS, len(paths))) as readers:
+        documents = [doc for doc in readers.map(_read_source, paths) if doc is not None]
+
+    if not documents:
+        return [], 0
+
+    splitter = _get_splitter(lang_constant, chunk_size, chunk_overlap)
+    return splitter.split_documents(documents), len(documents)
+
+def load_and_split_code(directory: str, chunk_size: int = 1000, chunk_overlap: int = 100, previous=None, preload=None,
+                        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES):
+    """
+    Load and split code files in worker processes, sharding large language groups.
+
+    Files whose mtime and size match their entry in `previous` (a manifest from
+    load_manifest) are skipped. If any file needs splitting, `preload` is run on a
+    background thread while the workers split. Returns (chunks, manifest for this
+    run, Future of preload() or None).
+    """
+    all_chunks = []
+    preloaded = None
+    dropped = 0
+    previous = previous or {}
+
+    files, stats, skipped_dirs, skipped_files = scan_source_files(directory, max_file_bytes)
+    manifest = {}
+    unchanged = 0
+    for extensions, paths in files.items():
+        changed = []
+        for path in paths:
+            entry = previous.get(path)
+            if entry is not None and entry["stat"] == stats[path]:
+                manifest[path] = entry
+                unchanged += 1
+            else:
+                manifest[path] = {"stat": stats[path], "ids": []}
+                changed.append(path)
+        files[extensions] = changed
+
+    groups = [(extensions, lang) for extensions, lang in LANGUAGE_MAPPING.items() if files[extensions]]
+    # Fixed-size shards let one large group (typically JS/TS) spread over every core
+    shards = []
+    for extensions, lang_constant in groups:
+        paths = files[extensions]
+        shards.append((lang_constant, [paths[i:i + SHARD_FILES] for i in range(0, len(paths), SHARD_FILES)]))
+    workers = max(1, min(sum(len(parts) for _, parts in shards), os.cpu_count() or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            (lang_constant, [pool.submit(_load_split_one, part, lang_constant, chunk_size, chunk_overlap) for part in parts])
+            for lang_constant, parts in shards
+        ]
+        # Workers are only forked inside submit(), so from here on nothing loaded in this process reaches them
+        if preload is not None and futures:
+            background = ThreadPoolExecutor(max_workers=1)
+            preloaded = background.submit(preload)
+            background.shutdown(wait=False)
+        # Collect in LANGUAGE_MAPPING and file order so the log and chunk order stay deterministic
+        for lang_constant, group_futures in futures:
+            chunks, file_count = [], 0
+            for future in group_futures:
+                part_chunks, part_count = future.result()
+                chunks.extend(part_chunks)
+                file_count += part_count
+            if not file_count:
+                continue
+            # Braces, blank config stanzas and one-line stubs would only add retrieval noise
+            kept = [chunk for chunk in chunks if len(chunk.page_content.strip()) >= MIN_CHUNK_CHARS]
+            dropped += len(chunks) - len(kept)
+            chunks = kept
+            all_chunks.extend(chunks)
+            print(f"✓ Loaded {file_count} files for {lang_constant.name}. Created {len(chunks)} chunks.")
+
+    for chunk in all_chunks:
+        manifest[chunk.metadata["source"]]["ids"].append(chunk_id(chunk))
 
     print(f"\n{'='*60}")
-    if excluded_count > 0:
-        print(f"⚙️  Excluded {excluded_count} files from directories like: {', '.join(list(sorted(EXCLUDE_DIRS))[:5])}...")
+    if skipped_dirs > 0:
+        print(f"⚙️  Skipped {skipped_dirs} directories like: {', '.join(list(sorted(EXCLUDE_DIRS))[:5])}...")
+    if skipped_files > 0:
+        print(f"⚙️  Skipped {skipped_files} empty or oversized files (limit: {max_file_bytes} bytes)")
+    if unchanged > 0:
+        print(f"⚙️  {unchanged} files unchanged since the last run")
+    if dropped > 0:
+        print(f"⚙️  Dropped {dropped} chunks shorter than {MIN_CHUNK_CHARS} characters")
     print(f"Total chunks created: {len(all_chunks)}")
     print(f"{'='*60}\n")
-    return all_chunks
+    return all_chunks, manifest, preloaded
 
-def create_vector_store(chunks, embeddings, path, collection_name):
-    """Create vector store with batch processing"""
-    if not chunks:
+def get_embedding_device() -> str:
+    """Pick the fastest available device for the embedding model"""
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+def load_embedding_model():
+    """Load the local embedding model, preferring the ONNX export on CPU when EMBED_BACKEND=onnx"""
+    print("Initializing local embedding model (may download on first run)...")
+    device = get_embedding_device()
+    model_kwargs = {'device': device}
+    if EMBED_BACKEND == "onnx" and device == "cpu":
+        model_kwargs.update(backend="onnx", model_kwargs={'file_name': EMBED_ONNX_FILE})
+        device = f"cpu, onnx {EMBED_ONNX_FILE}"
+    embeddings = HuggingFaceEmbeddings(
+        model_name=DEFAULT_EMBED_MODEL,
+        model_kwargs=model_kwargs,
+        encode_kwargs={'batch_size': EMBED_BATCH_SIZE, 'normalize_embeddings': True}
+    )
+    print(f"✓ Model ready ({device})")
+    return embeddings
+
+def chunk_id(chunk) -> str:
+    """Stable id for a chunk: hash of the embedding model and backend, its source path and text"""
+    key = f"{EMBED_SIGNATURE}\0{chunk.metadata.get('source', '')}\0{chunk.page_content}".encode("utf-8")
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+def _store_kwargs(path: str):
+    """Chroma connection arguments and a printable location"""
+    if CHROMA_HOST:
+        import chromadb
+        return {"client": chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)}, f"http://{CHROMA_HOST}:{CHROMA_PORT}"
+    return {"persist_directory": path}, path
+
+def count_stored_chunks(path: str, collection_name: str) -> int:
+    """Chunks currently in the collection (creating it empty if it doesn't exist)"""
+    store_kwargs, _ = _store_kwargs(path)
+    return Chroma(collection_name=collection_name, embedding_function=None, **store_kwargs)._collection.count()
+
+def create_vector_store(chunks, embeddings, path, collection_name, stale_ids=(), full=False):
+    """Create vector store with batch processing, first removing `stale_ids`; `full` re-embeds stored chunks too"""
+    if not chunks and not stale_ids:
         print("⚠️  WARNING: No code chunks were found.")
         return None
 
+    store_kwargs, location = _store_kwargs(path)
+
     print(f"Creating vector store with {len(chunks)} chunks using LOCAL embeddings...")
     print("(First run may take time to download the model)")
     
-    BATCH_SIZE = 1000
-    
-    if len(chunks) > BATCH_SIZE:
+    vector_store = Chroma(collection_name=collection_name, embedding_function=embeddings, **store_kwargs)
+    collection = vector_store._collection
+    # Few large writes mean few SQLite transactions; Chroma rejects batches above its own limit
+    get_max_batch_size = getattr(vector_store._client, "get_max_batch_size", None)
+    BATCH_SIZE = min(WRITE_BATCH_SIZE, get_max_batch_size()) if get_max_batch_size else WRITE_BATCH_SIZE
+    if stale_ids:
+        for i in range(0, len(stale_ids), BATCH_SIZE):
+            collection.delete(ids=stale_ids[i:i + BATCH_SIZE])
+        print(f"🗑️  Removed {len(stale_ids)} chunks of changed or deleted files")
+    # Content-derived ids: repeated chunks collapse to one, and re-indexing skips what is stored
+    unique = {chunk_id(chunk): chunk for chunk in chunks}
+    if len(unique) < len(chunks):
+        print(f"⚙️  Dropped {len(chunks) - len(unique)} duplicate chunks")
+    items = list(unique.items())
+    batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+    if len(batches) > 1:
         print(f"⚙️  Processing in batches of {BATCH_SIZE}...")
-        
-        vector_store = None
-        total_batches = (len(chunks) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        for i in range(0, len(chunks), BATCH_SIZE):
-            batch = chunks[i:i + BATCH_SIZE]
-            batch_num = (i // BATCH_SIZE) + 1
-            
-            print(f"   Batch {batch_num}/{total_batches} ({len(batch)} chunks)...", end=" ")
-            
+    skipped = reused = 0
+    
+    def embed(batch):
+        stored = set() if full else set(collection.get(ids=[chunk_id for chunk_id, _ in batch], include=[])["ids"])
+        new = [(chunk_id, chunk) for chunk_id, chunk in batch if chunk_id not in stored]
+        # Identical text in different files (license headers, boilerplate) is embedded once;
+        # chunks are length-sorted, so such copies land in the same batch
+        texts = [chunk.page_content for _, chunk in new]
+        distinct = list(dict.fromkeys(texts))
+        by_text = dict(zip(distinct, embeddings.embed_documents(distinct))) if distinct else {}
+        return new, [by_text[text] for text in texts], len(batch) - len(new), len(texts) - len(distinct)
+    
+    # Embed the next batch while the current one is written, so the model never waits on Chroma
+    with ThreadPoolExecutor(max_workers=1) as embedder:
+        pending = embedder.submit(embed, batches[0]) if batches else None
+        for batch_num, batch in enumerate(batches, 1):
+            if len(batches) > 1:
+                print(f"   Batch {batch_num}/{len(batches)} ({len(batch)} chunks)...", end=" ")
             try:
-                if vector_store is None:
-                    vector_store = Chroma.from_documents(
-                        documents=batch,
-                        embedding=embeddings,
-                        persist_directory=path,
-                        collection_name=collection_name
+                new, vectors, already_stored, shared = pending.result()
+                if batch_num < len(batches):
+                    pending = embedder.submit(embed, batches[batch_num])
+                skipped += already_stored
+                reused += shared
+                if new:
+                    collection.upsert(
+                        ids=[chunk_id for chunk_id, _ in new],
+                        embeddings=vectors,
+                        documents=[chunk.page_content for _, chunk in new],
+                        metadatas=[chunk.metadata for _, chunk in new],
                     )
-                else:
-                    vector_store.add_documents(batch)
-                
-                print("✓")
             except Exception as e:
                 print(f"❌ Error: {e}")
                 raise
-        
-        print(f"\n✅ Vector store created with {len(chunks)} chunks")
-    else:
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=path,
-            collection_name=collection_name
-        )
-        print(f"✅ Vector store created")
+            if len(batches) > 1:
+                print("✓")
     
+    print(f"\n✅ Vector store created with {len(unique)} chunks")
+    if skipped:
+        print(f"   {skipped} unchanged chunks were already indexed and reused")
+    if reused:
+        print(f"   {reused} chunks shared an embedding with identical text from another file")
     print(f"   Collection: {collection_name}")
-    print(f"   Location: {path}")
+    print(f"   Location: {location}")
     return vector_store
 
 def parse_arguments():
@@ -169,6 +385,9 @@ def parse_arguments():
     parser.add_argument("-c", "--collection", type=str, default=DEFAULT_COLLECTION_NAME)
     parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
     parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--max-file-size", type=int, default=DEFAULT_MAX_FILE_BYTES,
+                        help="Skip files larger than this many bytes (0 for no limit)")
+    parser.add_argument("--full", action="store_true", help="Re-read and re-embed every file, ignoring the manifest and stored chunks")
     
     return parser.parse_args()
 
@@ -189,32 +408,53 @@ def main():
         print(f"❌ ERROR: Directory '{args.codebase_path}' does not exist.")
         sys.exit(1)
     
-    print("Initializing local embedding model (may download on first run)...")
-    try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name=DEFAULT_EMBED_MODEL,
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        print("✓ Model ready\n")
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
-        sys.exit(1)
+    manifest_file = manifest_path(args.output, args.collection)
     
     try:
-        chunks = load_and_split_code(
+        previous, reusable = load_manifest(manifest_file, args.chunk_size, args.chunk_overlap)
+        if reusable and not args.full and previous:
+            # A wiped or recreated collection no longer holds what the manifest says was written
+            listed = len({i for entry in previous.values() for i in entry["ids"]})
+            if count_stored_chunks(args.output, args.collection) < listed:
+                print("⚠️  The collection holds fewer chunks than the manifest lists; re-indexing every file")
+                reusable = False
+        # The model loads while the files are split instead of after
+        chunks, manifest, model_future = load_and_split_code(
             args.codebase_path,
             chunk_size=args.chunk_size,
-            chunk_overlap=args.chunk_overlap
+            chunk_overlap=args.chunk_overlap,
+            previous=previous if reusable and not args.full else None,
+            preload=load_embedding_model,
+            max_file_bytes=args.max_file_size
         )
         
-        if not chunks:
+        if not manifest:
             print("\n❌ No code files found!")
             sys.exit(1)
         
-        vector_store = create_vector_store(chunks, embeddings, args.output, args.collection)
+        # Chunks of files that changed or disappeared since the last run
+        current_ids = {i for entry in manifest.values() for i in entry["ids"]}
+        stale_ids = sorted({i for entry in previous.values() for i in entry["ids"]} - current_ids)
+        if not chunks and not stale_ids:
+            save_manifest(manifest_file, args.chunk_size, args.chunk_overlap, manifest)
+            print("✅ Index is already up to date")
+            return
+        
+        # Similar-length chunks share encoder batches, so little compute is spent on padding
+        chunks.sort(key=lambda c: len(c.page_content))
+        
+        embeddings = None
+        if chunks:
+            try:
+                embeddings = model_future.result()
+            except Exception as e:
+                print(f"❌ Error loading model: {e}")
+                sys.exit(1)
+        
+        vector_store = create_vector_store(chunks, embeddings, args.output, args.collection, stale_ids, full=args.full)
         
         if vector_store:
+            save_manifest(manifest_file, args.chunk_size, args.chunk_overlap, manifest)
             print("\n" + "="*60)
             print("✅ INDEXING COMPLETE (LOCAL MODE)")
             print("="*60)
@@ -17,38 +17,41 @@ import sys
 import argparse
 from pathlib import Path
 
-# Check if we're in a virtual environment
-venv_paths = [
-    Path(__file__).parent / ".venv" / "bin" / "python",
-    Path(__file__).parent / "venv" / "bin" / "python",
-    Path.home() / ".venv" / "bin" / "python",
-]
 
-if not hasattr(sys, 'real_prefix') and not (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix):
-    # Not in a virtual environment - check if one exists
-    for venv_py in venv_paths:
-        if venv_py.exists():
-            venv_dir = venv_py.parent.parent
-            print(f"\n⚠️  WARNING: You're not using a virtual environment!")
-            print(f"   A virtual environment was found at: {venv_dir}")
-            print(f"   Activate it first:")
-            print(f"   \tsource {venv_dir}/bin/activate")
-            print(f"   Then run this script again.\n")
-            print(f"   Continuing with system Python anyway...\n")
-            break
+def check_environment():
+    """Warn about an inactive virtual environment and load .env before any app module is imported"""
+    venv_paths = [
+        Path(__file__).parent / ".venv" / "bin" / "python",
+        Path(__file__).parent / "venv" / "bin" / "python",
+        Path.home() / ".venv" / "bin" / "python",
+    ]
+    
+    if not hasattr(sys, 'real_prefix') and not (hasattr(sys, 'base_prefix') and sys.base_prefix != sys.prefix):
+        # Not in a virtual environment - check if one exists
+        for venv_py in venv_paths:
+            if venv_py.exists():
+                venv_dir = venv_py.parent.parent
+                print(f"\n⚠️  WARNING: You're not using a virtual environment!")
+                print(f"   A virtual environment was found at: {venv_dir}")
+                print(f"   Activate it first:")
+                print(f"   \tsource {venv_dir}/bin/activate")
+                print(f"   Then run this script again.\n")
+                print(f"   Continuing with system Python anyway...\n")
+                break
+    
+    # Try to import dotenv, give helpful error if not available
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        print("⚠️  python-dotenv not found.")
+        print("   Make sure you're using the same Python environment as your server.")
+        print("   If using a virtual environment, activate it first:")
+        print("   \tsource .venv/bin/activate  # or: source venv/bin/activate")
+        print("   Then install dependencies:")
+        print("   \tpip install -r requirements.txt\n")
+        sys.exit(1)
 
-# Try to import dotenv, give helpful error if not available
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    print("⚠️  python-dotenv not found.")
-    print("   Make sure you're using the same Python environment as your server.")
-    print("   If using a virtual environment, activate it first:")
-    print("   \tsource .venv/bin/activate  # or: source venv/bin/activate")
-    print("   Then install dependencies:")
-    print("   \tpip install -r requirements.txt\n")
-    sys.exit(1)
 
 def test_health():
     """Test system health checks"""
@@ -61,7 +64,10 @@ def test_health():
     # Check vector store
     print("1️⃣ Checking Vector Store...")
     try:
-        from app.graph_rag import vectorstore
+        from app import graph_rag
+        # GraphRAG is not initialized at import, and there is no server lifespan here to do it
+        graph_rag.ensure_initialized()
+        vectorstore = graph_rag.vectorstore
         if vectorstore is None:
             print("   ❌ Vector store not initialized")
             checks["vectorstore"] = False
@@ -247,6 +253,7 @@ def main():
     )
     
     args = parser.parse_args()
+    check_environment()
     
     if args.health:
         test_health()
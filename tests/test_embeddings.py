@@ -0,0 +1,104 @@
+"""Unit tests for the pure helpers in BatchedEmbeddings and the query batcher."""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("langchain_core")
+
+from app import embeddings
+from app.embeddings import BatchedEmbeddings, _QueryBatcher
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"data": self._data}
+
+
+def test_scatter_restores_original_positions():
+    # Two batches of length-sorted positions; items may come back out of order
+    batches = [[2, 0], [3, 1]]
+    responses = [
+        FakeResponse([{"index": 1, "embedding": [0.0]}, {"index": 0, "embedding": [2.0]}]),
+        FakeResponse([{"index": 0, "embedding": [3.0]}, {"index": 1, "embedding": [1.0]}]),
+    ]
+    assert BatchedEmbeddings._scatter(batches, responses, 4) == [[0.0], [1.0], [2.0], [3.0]]
+
+
+def test_scatter_raises_on_http_error():
+    class ErrorResponse(FakeResponse):
+        def raise_for_status(self):
+            raise RuntimeError("503")
+
+    with pytest.raises(RuntimeError):
+        BatchedEmbeddings._scatter([[0]], [ErrorResponse([])], 1)
+
+
+def test_query_key_normalizes_whitespace():
+    key = BatchedEmbeddings._query_key("where is  the\tgraph\nloaded")
+    assert key == BatchedEmbeddings._query_key("  where is the graph loaded ")
+    assert key != BatchedEmbeddings._query_key("where is the graph loaded?")
+    assert key != BatchedEmbeddings._query_key("Where is the graph loaded")
+
+
+def embed_concurrently(batcher, texts):
+    """Call batcher.embed from one thread per text, all released at once."""
+    start = threading.Barrier(len(texts))
+
+    def call(text):
+        start.wait()
+        try:
+            return batcher.embed(text)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        return list(pool.map(call, texts))
+
+
+def test_query_batcher_coalesces_concurrent_callers():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [[float(text)] for text in texts]
+
+    texts = [str(i) for i in range(8)]
+    results = embed_concurrently(_QueryBatcher(embed_many, window_ms=200), texts)
+    assert len(calls) == 1 and sorted(calls[0]) == texts
+    # Every caller gets the vector for its own text
+    assert results == [[float(text)] for text in texts]
+
+
+def test_query_batcher_raises_in_every_waiter():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        raise RuntimeError("embedder down")
+
+    results = embed_concurrently(_QueryBatcher(embed_many, window_ms=200), ["a", "b", "c"])
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_async_clients_are_closed_on_shutdown(monkeypatch):
+    embedder = BatchedEmbeddings("test-model", "http://infinity.test")
+    monkeypatch.setattr(embeddings, "_embedder", embedder)
+
+    async def main():
+        client = embedder._get_async_http()
+        await embeddings.close_async_embedding_clients()
+        return client
+
+    client = asyncio.run(main())
+    assert client.is_closed
+    assert not embedder._async_http
@@ -0,0 +1,177 @@
+"""Unit tests for GraphLoader traversal and lookups, served from an in-memory payload."""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("numpy")
+
+from app import graph_loader
+from app.graph_loader import GraphLoader
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self._data = data
+        self.content = json.dumps(data).encode("utf-8")
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+@pytest.fixture
+def make_loader(monkeypatch):
+    def make(nodes, edges):
+        response = FakeResponse({"nodes": nodes, "edges": edges})
+        monkeypatch.setattr(graph_loader, "_http_client", SimpleNamespace(get=lambda *args, **kwargs: response))
+        monkeypatch.setattr(graph_loader, "GRAPH_CACHE_PATH", "")
+        loader = GraphLoader(graph_url="http://graph.test")
+        assert loader.load()
+        return loader
+
+    return make
+
+
+def node(node_id, **fields):
+    return {"id": node_id, "label": node_id, **fields}
+
+
+def edge(from_id, to_id, relation="CALLS"):
+    return {"from": from_id, "to": to_id, "relation": relation}
+
+
+@pytest.fixture
+def chain_graph(make_loader):
+    # a -> b -> c -> d, plus b -USES-> e
+    return make_loader(
+        [node(n) for n in "abcde"],
+        [edge("a", "b"), edge("b", "c"), edge("c", "d"), edge("b", "e", "USES")],
+    )
+
+
+def test_traverse_depth_counts_hops(chain_graph):
+    assert chain_graph.traverse(["a"], depth=0) == {"a"}
+    assert chain_graph.traverse(["a"], depth=1) == {"a", "b"}
+    assert chain_graph.traverse(["a"], depth=2) == {"a", "b", "c", "e"}
+    assert chain_graph.traverse(["a"], depth=3) == {"a", "b", "c", "d", "e"}
+
+
+def test_traverse_follows_edges_in_both_directions(chain_graph):
+    assert chain_graph.traverse(["d"], depth=1) == {"c", "d"}
+    assert chain_graph.traverse(["c"], depth=1) == {"b", "c", "d"}
+
+
+def test_traverse_relation_filters(chain_graph):
+    assert chain_graph.traverse(["b"], depth=1, relation_filters=["USES"]) == {"b", "e"}
+    assert chain_graph.traverse(["b"], depth=2, relation_filters=["MISSING"]) == {"b"}
+
+
+def test_traverse_keeps_unknown_start_ids(chain_graph):
+    assert chain_graph.traverse(["a", "ghost"], depth=1) == {"a", "b", "ghost"}
+
+
+def test_traverse_before_load_is_empty():
+    assert GraphLoader(graph_url="http://graph.test").traverse(["a"]) == set()
+
+
+def test_find_vehicle_nodes_includes_ids_inside_a_match(make_loader):
+    loader = make_loader(
+        [
+            node("v1", type="Vehicle", payload={"id": "CAR-12"}),
+            node("v2", type="Vehicle", payload={"id": "CAR-123"}),
+            node("v3", type="Vehicle", payload={"id": "R-1"}),
+            node("v4", type="Vehicle", payload={"id": "VAN-9"}),
+        ],
+        [],
+    )
+    assert loader.find_vehicle_nodes_in_text("status of car-123?") == {"v1", "v2", "v3"}
+    assert loader.find_vehicle_nodes_in_text("car-12 and van-9") == {"v1", "v3", "v4"}
+    assert loader.find_vehicle_nodes_in_text("no vehicles here") == set()
+
+
+def test_traverse_reaches_edge_endpoints_missing_from_nodes(make_loader):
+    loader = make_loader([node("a")], [edge("a", "external"), edge("external", "deeper")])
+    assert loader.traverse(["a"], depth=2) == {"a", "external", "deeper"}
+
+
+def test_traverse_max_nodes_keeps_best_connected(make_loader):
+    # s links to a hub (3 more edges) and a leaf; only one neighbour fits
+    loader = make_loader(
+        [node(n) for n in ("s", "hub", "leaf", "x", "y", "z")],
+        [edge("s", "leaf"), edge("s", "hub"), edge("hub", "x"), edge("hub", "y"), edge("hub", "z")],
+    )
+    assert loader.traverse(["s"], depth=2, max_nodes=2) == {"s", "hub"}
+    # The limit stops expansion before the next level is visited
+    assert loader.traverse(["s"], depth=2, max_nodes=3) == {"s", "hub", "leaf"}
+
+
+def test_traverse_max_nodes_always_keeps_start_nodes(chain_graph):
+    assert chain_graph.traverse(["a", "c", "d"], depth=2, max_nodes=1) == {"a", "c", "d"}
+
+
+@pytest.fixture
+def source_graph(make_loader):
+    return make_loader(
+        [
+            node("widget", source="web/src/components/Widget.tsx"),
+            node("sibling", source="other/src/index.js"),
+            node("nested", source="mycarhub/src/utils/deep/format.js"),
+            node("hub", source="mycarhub/app.js"),
+            node("service", source="mycarhub-service-hub/server.js"),
+            node("readme", source="docs/README.md"),
+            node("unrelated", source="api/routes/users.py"),
+        ],
+        [],
+    )
+
+
+def sources_matching(loader, source_path):
+    return {n["id"] for n in loader.find_nodes_by_source(source_path)}
+
+
+def test_find_nodes_by_source_matches_basename(source_graph):
+    assert "widget" in sources_matching(source_graph, "/abs/checkout/lib/widget.tsx")
+
+
+def test_find_nodes_by_source_matches_same_parent_dir(source_graph):
+    assert sources_matching(source_graph, "mycarhub/src/main.js") >= {"sibling"}
+
+
+def test_find_nodes_by_source_matches_directory_containment(source_graph):
+    assert sources_matching(source_graph, "mycarhub/src/main.js") == {"sibling", "nested"}
+
+
+def test_find_nodes_by_source_matches_one_level_dir_suffix(source_graph):
+    # "hub/" appears inside every "mycarhub/" and "mycarhub-service-hub/" path
+    assert sources_matching(source_graph, "hub/main.js") == {"hub", "nested", "service"}
+
+
+def test_find_nodes_by_source_ignores_loose_dir_prefixes(source_graph):
+    assert sources_matching(source_graph, "mycarhub/main.js") == {"hub", "nested"}
+
+
+def test_find_nodes_by_source_bare_filename_matches_basename_only(source_graph):
+    assert sources_matching(source_graph, "README.md") == {"readme"}
+    assert sources_matching(source_graph, "missing.txt") == set()
+
+
+def test_graph_cache_is_kept_per_graph_url(monkeypatch, tmp_path):
+    monkeypatch.setattr(graph_loader, "GRAPH_CACHE_PATH", str(tmp_path / "graph_cache.json"))
+    response = FakeResponse({"nodes": [node("a")], "edges": []})
+    monkeypatch.setattr(graph_loader, "_http_client", SimpleNamespace(get=lambda *args, **kwargs: response))
+    first = GraphLoader(graph_url="http://analytics-a.test/graph/nodes")
+    assert first.load()
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("graph API down")
+
+    monkeypatch.setattr(graph_loader, "_http_client", SimpleNamespace(get=unavailable))
+    # The same URL falls back to its own cached payload; another URL has nothing cached
+    assert GraphLoader(graph_url="http://analytics-a.test/graph/nodes").load(use_cache=False)
+    other = GraphLoader(graph_url="http://analytics-b.test/graph/nodes")
+    assert other.cache_path != first.cache_path
+    assert not other.load()
@@ -0,0 +1,55 @@
+"""Unit tests for indexer chunk ids and the incremental-indexing manifest."""
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("langchain_text_splitters")
+pytest.importorskip("langchain_community")
+
+import index_codebase
+
+
+def chunk(text, source="app/main.py"):
+    return SimpleNamespace(page_content=text, metadata={"source": source})
+
+
+def test_chunk_id_is_stable_for_same_source_and_text():
+    assert index_codebase.chunk_id(chunk("def f(): pass")) == index_codebase.chunk_id(chunk("def f(): pass"))
+
+
+def test_chunk_id_depends_on_source_text_and_embedding(monkeypatch):
+    base = index_codebase.chunk_id(chunk("def f(): pass"))
+    assert index_codebase.chunk_id(chunk("def f(): pass", source="app/other.py")) != base
+    assert index_codebase.chunk_id(chunk("def g(): pass")) != base
+    monkeypatch.setattr(index_codebase, "EMBED_SIGNATURE", "other-model|torch")
+    assert index_codebase.chunk_id(chunk("def f(): pass")) != base
+
+
+def test_manifest_round_trip_is_reusable(tmp_path):
+    path = str(tmp_path / "db" / "code.manifest.json")
+    files = {"app/main.py": {"stat": [1, 2], "ids": ["abc"]}}
+    index_codebase.save_manifest(path, 1000, 100, files)
+    assert index_codebase.load_manifest(path, 1000, 100) == (files, True)
+
+
+def test_manifest_not_reusable_after_settings_change(tmp_path, monkeypatch):
+    path = str(tmp_path / "code.manifest.json")
+    files = {"app/main.py": {"stat": [1, 2], "ids": ["abc"]}}
+    index_codebase.save_manifest(path, 1000, 100, files)
+    # Old ids are still returned so their chunks can be deleted
+    assert index_codebase.load_manifest(path, 500, 100) == (files, False)
+    monkeypatch.setattr(index_codebase, "EMBED_SIGNATURE", "other-model|torch")
+    assert index_codebase.load_manifest(path, 1000, 100) == (files, False)
+
+
+def test_missing_manifest_is_empty(tmp_path):
+    assert index_codebase.load_manifest(str(tmp_path / "missing.json"), 1000, 100) == ({}, False)
+
+
+def test_manifest_path_is_keyed_by_chroma_server(monkeypatch):
+    monkeypatch.setattr(index_codebase, "CHROMA_HOST", "")
+    assert index_codebase.manifest_path("db", "code") == os.path.join("db", "code.manifest.json")
+    monkeypatch.setattr(index_codebase, "CHROMA_HOST", "chroma.internal")
+    monkeypatch.setattr(index_codebase, "CHROMA_PORT", 8000)
+    assert index_codebase.manifest_path("db", "code").endswith("chroma.internal_8000.code.manifest.json")
@@ -0,0 +1,38 @@
+"""Unit tests for the incremental /index/output and /index/stream cursor."""
+from collections import deque
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app import main
+
+
+@pytest.fixture
+def small_log(monkeypatch):
+    # A 3-line buffer so a short run already rotates it
+    monkeypatch.setattr(main, "indexing_output", deque(maxlen=3))
+    monkeypatch.setattr(main, "indexing_output_total", 0)
+    return lambda count: [main._append_output(f"line {i}") for i in range(count)]
+
+
+def test_output_since_returns_only_new_lines(small_log):
+    small_log(2)
+    assert main._output_since(0) == (["line 0", "line 1"], 2)
+    assert main._output_since(1) == (["line 1"], 2)
+    assert main._output_since(2) == ([], 2)
+
+
+def test_output_since_skips_lines_rotated_out_of_the_buffer(small_log):
+    small_log(5)
+    # Lines 0 and 1 are gone; a client that read up to line 1 resumes at the oldest kept line
+    assert main._output_since(0) == (["line 2", "line 3", "line 4"], 5)
+    assert main._output_since(1) == (["line 2", "line 3", "line 4"], 5)
+    assert main._output_since(4) == (["line 4"], 5)
+    assert main._output_since(5) == ([], 5)
+
+
+def test_output_since_restarts_after_a_new_run(small_log):
+    small_log(2)
+    # A cursor past the end comes from a previous, longer run
+    assert main._output_since(7) == (["line 0", "line 1"], 2)
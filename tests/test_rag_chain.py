@@ -0,0 +1,129 @@
+"""Unit tests for SageMaker stop-token handling and prompt batching."""
+import asyncio
+
+import orjson
+import pytest
+
+pytest.importorskip("boto3")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_chroma")
+
+from app import rag_chain
+from app.rag_chain import SageMakerServerlessLLM
+
+
+@pytest.mark.parametrize(
+    "text, stop_tokens, expected",
+    [
+        ("answer<|im_end|>junk", ["<|im_end|>"], 6),
+        ("a STOP b END", ["END", "STOP"], 2),
+        ("ab", ["abc"], -1),
+        ("no stop here", ["</s>", ""], -1),
+        ("</s>", ["</s>"], 0),
+    ],
+)
+def test_find_stop_returns_earliest_token(text, stop_tokens, expected):
+    assert SageMakerServerlessLLM._find_stop(text, stop_tokens) == expected
+
+
+def test_enforce_stop_tokens_truncates_at_earliest_token():
+    assert SageMakerServerlessLLM._enforce_stop_tokens("x Human: y Assistant: z", ["Assistant:", "Human:"]) == "x "
+    assert SageMakerServerlessLLM._enforce_stop_tokens("unchanged", ["Human:"]) == "unchanged"
+
+
+class EndpointError(Exception):
+    def __init__(self, status, code="ValidationError"):
+        super().__init__(f"{code} ({status})")
+        self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+class FakeEndpointLLM:
+    """Stands in for SageMakerServerlessLLM: answers "ans:<prompt>" and records each request body."""
+
+    _extract_text = SageMakerServerlessLLM._extract_text
+    _extract_from_obj = SageMakerServerlessLLM._extract_from_obj
+
+    def __init__(self, batch_error=None, batch_answers=None):
+        self.calls = []
+        self.batch_error = batch_error
+        self.batch_answers = batch_answers
+
+    async def _ainvoke_endpoint(self, payload):
+        self.calls.append(payload["inputs"])
+        inputs = payload["inputs"]
+        if isinstance(inputs, list):
+            if self.batch_error is not None:
+                raise self.batch_error
+            answers = self.batch_answers if self.batch_answers is not None else [f"ans:{p}" for p in inputs]
+            return orjson.dumps([{"generated_text": answer} for answer in answers]).decode()
+        return orjson.dumps({"generated_text": f"ans:{inputs}"}).decode()
+
+
+def run_batch(llm, payloads, monkeypatch):
+    monkeypatch.setattr(rag_chain, "SAGEMAKER_MAX_BATCH", 8)
+    monkeypatch.setattr(rag_chain, "SAGEMAKER_BATCH_WINDOW_MS", 20)
+
+    async def main():
+        batcher = rag_chain._SageMakerBatcher(llm)
+        try:
+            return await asyncio.gather(*(batcher.submit(payload) for payload in payloads)), batcher
+        finally:
+            batcher.close()
+
+    return asyncio.run(main())
+
+
+def payload(prompt, temperature=0.2):
+    return {"inputs": prompt, "parameters": {"temperature": temperature, "max_new_tokens": 16}}
+
+
+def test_batcher_groups_prompts_by_parameters(monkeypatch):
+    llm = FakeEndpointLLM()
+    answers, batcher = run_batch(llm, [payload("a"), payload("b", 0.9), payload("c")], monkeypatch)
+    assert answers == ["ans:a", "ans:b", "ans:c"]
+    assert sorted(llm.calls, key=str) == [["a", "c"], "b"]
+    assert batcher.batching_supported
+
+
+def test_batcher_falls_back_per_prompt_when_list_input_is_rejected(monkeypatch):
+    llm = FakeEndpointLLM(batch_error=EndpointError(400))
+    answers, batcher = run_batch(llm, [payload("a"), payload("b")], monkeypatch)
+    assert answers == ["ans:a", "ans:b"]
+    assert llm.calls == [["a", "b"], "a", "b"]
+    assert not batcher.batching_supported
+
+
+def test_batcher_keeps_batching_after_a_transient_error(monkeypatch):
+    llm = FakeEndpointLLM(batch_error=EndpointError(429, "ThrottlingException"))
+    answers, batcher = run_batch(llm, [payload("a"), payload("b")], monkeypatch)
+    assert answers == ["ans:a", "ans:b"]
+    assert batcher.batching_supported
+
+
+def test_batcher_falls_back_on_a_length_mismatched_list_response(monkeypatch):
+    llm = FakeEndpointLLM(batch_answers=["only one"])
+    answers, batcher = run_batch(llm, [payload("a"), payload("b")], monkeypatch)
+    assert answers == ["ans:a", "ans:b"]
+    assert not batcher.batching_supported
+
+
+def test_batcher_close_cancels_in_flight_dispatches(monkeypatch):
+    monkeypatch.setattr(rag_chain, "SAGEMAKER_MAX_BATCH", 8)
+    monkeypatch.setattr(rag_chain, "SAGEMAKER_BATCH_WINDOW_MS", 1)
+
+    class SlowLLM(FakeEndpointLLM):
+        async def _ainvoke_endpoint(self, payload):
+            await asyncio.sleep(60)
+
+    async def main():
+        batcher = rag_chain._SageMakerBatcher(SlowLLM())
+        pending = asyncio.ensure_future(batcher.submit(payload("a")))
+        while not batcher._dispatches:
+            await asyncio.sleep(0.005)
+        batcher.close()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        await asyncio.sleep(0)
+        assert not batcher._dispatches
+
+    asyncio.run(main())